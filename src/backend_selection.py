@@ -0,0 +1,184 @@
+"""
+Simulation method, precision and thread count for each Aer run, chosen from the circuits about to be run
+Clifford circuits go to the stabilizer method (polynomial memory), anything else to statevector, whose memory is
+estimated before running. A statevector that does not fit in the memory limit is downgraded to single precision,
+then to matrix product state when no full state is saved, and otherwise refused with MemoryError
+The limit is PFCF_MAX_MEMORY (bytes, or with a K/M/G/T suffix), or the physical memory of the machine
+Threads follow from the circuit too: one for small circuits whose shots are sampled from a single simulation,
+otherwise every core that fits in memory, since Aer gives each parallel shot its own copy of the state
+"""
+import logging
+import os
+
+from functools import lru_cache
+
+from qiskit import transpile
+
+from instrumentation import span
+
+logger = logging.getLogger("pfcf.backend")
+
+# Bytes per amplitude of a statevector
+AMPLITUDE_BYTES = {"double": 16, "single": 8}
+# Instructions every method runs
+ALWAYS_SUPPORTED = {"measure", "reset", "barrier"}
+# Saving the full state needs 2^n amplitudes whatever the method, so matrix product state does not help,
+# and the saved copy returned with the result doubles the memory of the run
+FULL_STATE_SAVES = {"save_statevector"}
+# Below this width Aer runs a statevector on one thread anyway (its statevector_parallel_threshold)
+PARALLEL_QUBITS = 14
+
+
+def parse_size(size):
+    # "512M", "8G", "1.5T" or a plain number of bytes
+    size = str(size).strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+def physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def default_max_memory():
+    return parse_size(os.environ["PFCF_MAX_MEMORY"]) if os.environ.get("PFCF_MAX_MEMORY") else physical_memory()
+
+# Module configuration, set by configure() from the scripts' command line
+_max_memory = default_max_memory()
+_precision = "auto"
+_threads = None
+
+
+def configure(max_memory=None, precision=None, threads=None, verbose=False):
+    # Replaces the whole configuration, so one job of a batch never inherits the settings of the previous one
+    # None means the default: PFCF_MAX_MEMORY or physical memory, automatic precision and threads
+    # verbose prints every decision on stderr
+    global _max_memory, _precision, _threads
+    _max_memory = default_max_memory() if max_memory is None else parse_size(max_memory)
+    _precision = precision or "auto"
+    _threads = threads
+    if verbose and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+@lru_cache(maxsize=None)
+def supported_instructions(method):
+    # From the public configuration of a simulator set to this method: its basis gates and the save/set
+    # instructions it accepts. Loads Aer, so only once something is about to run
+    from qiskit.providers.aer import AerSimulator
+    configuration = AerSimulator(method=method).configuration()
+    instructions = set(configuration.basis_gates) | set(getattr(configuration, "custom_instructions", []))
+    return frozenset(instructions | ALWAYS_SUPPORTED)
+
+def instruction_names(circuits):
+    return {instruction.operation.name for qc in circuits for instruction in qc.data}
+
+def is_clifford(circuits):
+    # Stabilizer method: Clifford gates, measurements and resets only, with no classically conditioned gate
+    supported = supported_instructions("stabilizer")
+    return all(instruction.operation.name in supported and instruction.operation.condition is None
+               for qc in circuits for instruction in qc.data)
+
+def statevector_bytes(num_qubits, precision="double", copies=1):
+    return copies * AMPLITUDE_BYTES[precision] * 2 ** num_qubits
+
+def samples_measurements(circuits):
+    # True when every measurement is final and nothing is conditioned, so Aer simulates once and samples all shots
+    for qc in circuits:
+        measured = set()
+        for instruction in qc.data:
+            operation = instruction.operation
+            if operation.condition is not None or operation.name == "reset":
+                return False
+            qubits = {qc.find_bit(qubit).index for qubit in instruction.qubits}
+            if operation.name == "measure":
+                measured |= qubits
+            elif operation.name != "barrier" and qubits & measured:
+                return False
+    return True
+
+def choose_threads(circuits, qubits, memory, max_memory):
+    # One thread when a single small simulation serves every shot. Otherwise all cores, as long as one state per
+    # thread fits in memory (parallel shots each hold their own state)
+    if qubits < PARALLEL_QUBITS and samples_measurements(circuits):
+        return 1
+    cores = os.cpu_count() or 1
+    if memory and max_memory is not None:
+        cores = min(cores, max(1, max_memory // memory))
+    return cores
+
+def select(circuits, max_memory=None, precision=None, threads=None):
+    # Decision for one Aer job: method, precision, threads, estimated memory and the reason, plus the run options
+    circuits = circuits if isinstance(circuits, list) else [circuits]
+    max_memory = _max_memory if max_memory is None else parse_size(max_memory)
+    precision = precision or _precision
+    threads = _threads if threads is None else threads
+    qubits = max(qc.num_qubits for qc in circuits)
+    decision = {"qubits": qubits, "max_memory": max_memory}
+
+    if is_clifford(circuits):
+        decision.update(method="stabilizer", precision=None, memory_bytes=2 * qubits * (2 * qubits + 1),
+                        reason="Clifford circuit")
+    else:
+        copies = 2 if instruction_names(circuits) & FULL_STATE_SAVES else 1
+        chosen = "single" if precision == "single" else "double"
+        memory = statevector_bytes(qubits, chosen, copies)
+        downgraded = max_memory is not None and memory > max_memory and precision == "auto"
+        if downgraded:
+            chosen = "single"
+            memory = statevector_bytes(qubits, chosen, copies)
+        reason = f"{qubits} qubits, statevector of {memory / 1024 ** 2:.3g} MB"
+        if downgraded:
+            reason += ", single precision to fit the memory limit"
+        decision.update(method="statevector", precision=chosen, memory_bytes=memory, reason=reason)
+        if max_memory is not None and memory > max_memory:
+            if copies > 1:
+                raise MemoryError(f"A {qubits}-qubit statevector needs {memory} bytes, over the limit of {max_memory}")
+            # Memory of a matrix product state depends on entanglement, unknown before running
+            decision.update(method="matrix_product_state", precision=None, memory_bytes=None,
+                            reason=f"{qubits}-qubit statevector over the memory limit")
+
+    if threads is None:
+        threads = choose_threads(circuits, qubits, decision["memory_bytes"], max_memory)
+    decision["threads"] = threads
+
+    options = {"method": decision["method"]}
+    if decision["precision"] is not None:
+        options["precision"] = decision["precision"]
+    if threads:
+        options["max_parallel_threads"] = threads
+    decision["options"] = options
+    logger.info(f"Simulation method {decision['method']}, precision {decision['precision']}, "
+                f"threads {threads or 'all'}: {decision['reason']}")
+    return decision
+
+def prepare(circuits, max_memory=None, precision=None, threads=None):
+    # Returns (circuits to run, decision) and runs as simulator.run(circuits, **decision["options"], ...)
+    # Circuits are only transpiled again when matrix product state needs a basis they are not in
+    with span("backend_selection") as selection_span:
+        decision = select(circuits, max_memory, precision, threads)
+        selection_span.set(**{key: value for key, value in decision.items() if key != "options"})
+        if decision["method"] == "matrix_product_state":
+            supported = supported_instructions("matrix_product_state")
+            if not instruction_names(circuits if isinstance(circuits, list) else [circuits]) <= supported:
+                basis = sorted(supported - ALWAYS_SUPPORTED)
+                circuits = transpile(circuits, basis_gates=basis + sorted(ALWAYS_SUPPORTED))
+    return circuits, decision
+
+def add_arguments(parser, threads=True):
+    # Command line options shared by every script that runs Aer
+    parser.add_argument('--max-memory', type=str, default=None,
+                        help='Memory allowed for a simulation, e.g. 8G. Defaults to PFCF_MAX_MEMORY or the physical memory')
+    parser.add_argument('--precision', choices=['auto', 'double', 'single'], default='auto',
+                        help='Statevector precision. auto is double unless only single fits in --max-memory')
+    if threads:
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Threads per Aer run. Defaults to one for small circuits, else every core that fits in memory')
+
+def configure_from(args, verbose=False):
+    configure(args.max_memory, args.precision, getattr(args, "threads", None), verbose)
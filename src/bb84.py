@@ -1,6 +1,12 @@
 import argparse
 import random
 import textwrap
+import time
+
+import numpy as np
+
+import bb84_postprocessing
+from instrumentation import span
 
 def main(key_size):
     # Definitions
@@ -59,12 +65,135 @@ def main(key_size):
     print(f"Bob gets reduced key'      : {''.join([str(x) for x in red_key_line])}")
 
 
+def random_bits(rng, n):
+    # n uniform bits packed 8 per byte (np.packbits order). Padding bits of the last byte are zero
+    packed = rng.integers(0, 256, size=(n + 7) // 8, dtype=np.uint8)
+    if n % 8:
+        packed[-1] &= (0xFF << (8 - n % 8)) & 0xFF
+    return packed
 
+def exchange_packed(rng, n, eavesdropper=False):
+    # Alice's state i is fully described by (key[i], base[i]), so no state strings are needed
+    key = random_bits(rng, n)
+    base = random_bits(rng, n)
 
+    # Intercept-resend: Eve measures in a random base and resends what she read in her own base
+    sent_key, sent_base = key, base
+    if eavesdropper:
+        eve_base = random_bits(rng, n)
+        eve_coin = random_bits(rng, n)
+        eve_match = ~(base ^ eve_base)
+        sent_key = (key & eve_match) | (eve_coin & ~eve_match)
+        sent_base = eve_base
 
-if __name__ == "__main__":
+    # Bob reads the right bit when his base matches the one the state was sent in, and a coin flip otherwise
+    base_line = random_bits(rng, n)
+    coin = random_bits(rng, n)
+    received_match = ~(sent_base ^ base_line)
+    key_line = (sent_key & received_match) | (coin & ~received_match)
+    match = ~(base ^ base_line)
+    return key, base, base_line, key_line, match
+
+def sift_packed(bits, match, n):
+    # Keep only the positions where the bases agree, as an unpacked 0/1 array
+    return np.unpackbits(bits, count=n)[np.unpackbits(match, count=n).astype(bool)]
+
+def main_numpy(key_size, seed=None, chunk_bits=2 ** 24, output=None, eavesdropper=False, noise=0.0,
+               postprocess=False, block_bits=2 ** 20):
+    # Works chunk by chunk, so memory stays constant whatever the key size
+    # With postprocess, every chunk's sifted key is split into post-processing blocks of at most block_bits and the
+    # output is the final key. The block, not the chunk, sets the size of the privacy amplification FFTs
+    rng = np.random.default_rng(seed)
+    chunk_bits = max(8, chunk_bits - chunk_bits % 8)
+    sifted_bits = 0
+    errors = 0
+    final_bits = 0
+    leaked = 0
+    aborted_blocks = 0
+    residual_errors = 0
+    qbers = []
+    block_sizes = []  # Sifted bits per block, to weight the QBER estimates
+    stage_times = {"sifting": [0.0, 0]}
+    carry = np.zeros(0, dtype=np.uint8)  # Output bits not yet written because they do not fill a byte
+    start = time.perf_counter()
+
+    out_file = open(output, 'wb') if output is not None else None
+    try:
+        for first in range(0, key_size, chunk_bits):
+            n = min(chunk_bits, key_size - first)
+            stage_start = time.perf_counter()
+            with span("bb84.sifting", bits=n):
+                key, _, _, key_line, match = exchange_packed(rng, n, eavesdropper)
+                red_key = sift_packed(key, match, n)
+                red_key_line = sift_packed(key_line, match, n)
+                if noise > 0:
+                    # Channel noise on the bits Bob keeps
+                    red_key_line ^= (rng.random(red_key_line.size, dtype=np.float32) < noise).astype(np.uint8)
+            stage_times["sifting"][0] += time.perf_counter() - stage_start
+            stage_times["sifting"][1] += n
+            sifted_bits += red_key.size
+            errors += int(np.count_nonzero(red_key != red_key_line))
+
+            out_bits = red_key
+            if postprocess:
+                final_blocks = []
+                for block_first in range(0, red_key.size, block_bits):
+                    block = slice(block_first, block_first + block_bits)
+                    with span("bb84.postprocess", bits=red_key[block].size) as post_span:
+                        result = bb84_postprocessing.postprocess(rng, red_key[block], red_key_line[block])
+                        post_span.set(qber=result["qber"], aborted=result["aborted"], leaked=result["leaked"])
+                    for stage, (seconds, bits_in) in result["stages"].items():
+                        stage_times.setdefault(stage, [0.0, 0])
+                        stage_times[stage][0] += seconds
+                        stage_times[stage][1] += bits_in
+                    qbers.append(result["qber"])
+                    block_sizes.append(red_key[block].size)
+                    aborted_blocks += result["aborted"]
+                    leaked += result["leaked"]
+                    residual_errors += result["residual_errors"] or 0
+                    final_bits += result["key"].size
+                    final_blocks.append(result["key"])
+                out_bits = np.concatenate(final_blocks) if final_blocks else np.zeros(0, dtype=np.uint8)
+
+            if out_file is not None:
+                with span("bb84.write", bits=out_bits.size):
+                    pending = np.concatenate([carry, out_bits])
+                    whole = pending.size - pending.size % 8
+                    out_file.write(np.packbits(pending[:whole]).tobytes())
+                    carry = pending[whole:]
+        if out_file is not None and carry.size:
+            out_file.write(np.packbits(carry).tobytes())
+    finally:
+        if out_file is not None:
+            out_file.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Bits transmitted      : {key_size}")
+    print(f"Sifted key bits       : {sifted_bits} ({sifted_bits / max(key_size, 1):.4f} of transmitted)")
+    print(f"Mismatched sifted bits: {errors}")
+    if postprocess:
+        if qbers:
+            # Weighted by block size, so a short trailing block counts for little
+            print(f"Estimated QBER        : {np.average(qbers, weights=block_sizes):.4f}" + (" (eavesdropper present)" if eavesdropper else ""))
+        else:
+            print(f"Estimated QBER        : no sifted bits to sample")
+        print(f"Aborted blocks        : {aborted_blocks} of {len(qbers)} (QBER above {bb84_postprocessing.QBER_LIMIT})")
+        print(f"Parity bits disclosed : {leaked}")
+        print(f"Errors after Cascade  : {residual_errors}")
+        print(f"Final secret key bits : {final_bits}")
+        print(f"================ Throughput per stage ================")
+        for stage, (seconds, bits_in) in stage_times.items():
+            print(f"{stage:<22}: {seconds:.3f} s ({bits_in / max(seconds, 1e-9):.3e} bits in/s)")
+        print(f"Secret key rate       : {final_bits / max(elapsed, 1e-9):.3e} secret bits/s")
+    print(f"Elapsed               : {elapsed:.3f} s ({key_size / max(elapsed, 1e-9):.3e} bits/s)")
+    if output is not None:
+        print(f"{'Final' if postprocess else 'Sifted'} key written to : {output}")
+    return sifted_bits, errors
+
+def build_parser(prog=None):
     # Script instruction
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=textwrap.dedent(
         """
         This script implements the BB-84 protocol in order to exemplify its operation \n
@@ -73,12 +202,46 @@ if __name__ == "__main__":
         """),
         epilog=textwrap.dedent(
         """
-        Example usage: python src/bb84.py -n 10
+        Example usages:
+        python src/bb84.py -n 10
+        python src/bb84.py -n 100000000 --engine numpy --seed 1 -o sifted.bin
+        python src/bb84.py -n 10000000 --engine numpy --noise 0.02 --postprocess -o secret.bin
+        python src/bb84.py -n 1000000 --engine numpy --eve --postprocess
         """),
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-n', nargs=1, type=int, help='Number of bits in the key-string to be transmitted', required=True)
-    args = parser.parse_args()
+    parser.add_argument('--engine', choices=['list', 'numpy'], default='list',
+                        help=textwrap.dedent(
+                        """
+                        Implementation. Defaults to list
+                        list: element by element, printing every key and base
+                        numpy: vectorized on packed bit arrays, chunked to constant memory, printing only a summary
+                        """))
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the numpy engine')
+    parser.add_argument('--chunk', type=int, default=2 ** 24, help='Bits per chunk in the numpy engine. Defaults to 2^24')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Binary file for the sifted key (numpy engine)')
+    parser.add_argument('--eve', action='store_true', help='Intercept-resend eavesdropper on the channel (numpy engine)')
+    parser.add_argument('--noise', type=float, default=0.0, help='Channel bit-flip probability (numpy engine)')
+    parser.add_argument('--postprocess', action='store_true',
+                        help='QBER estimation, Cascade and Toeplitz privacy amplification on each block (numpy engine)')
+    parser.add_argument('--block', type=int, default=2 ** 20,
+                        help=textwrap.dedent(
+                        """
+                        Sifted bits per post-processing block. Defaults to 2^20
+                        The amplification FFTs hold a few buffers of about 4x this many float64 values:
+                        32 MB each at the default, 512 MB each at 2^24
+                        """))
+    return parser
+
+def run(args):
     n = abs(args.n[0])
 
     # Call the BB84
-    main(n)
\ No newline at end of file
+    with span(f"bb84.{args.engine}", key_size=n):
+        if args.engine == 'numpy':
+            main_numpy(n, args.seed, args.chunk, args.output, args.eve, args.noise, args.postprocess, args.block)
+        else:
+            main(n)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
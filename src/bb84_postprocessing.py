@@ -0,0 +1,122 @@
+"""
+Post-processing of a sifted BB-84 key: QBER estimation, Cascade error reconciliation and privacy amplification
+Keys are unpacked uint8 arrays of 0/1 values, one block at a time
+** THIS IS NOT A SECURE IMPLEMENTATION OF QKD POST-PROCESSING **
+"""
+import math
+import time
+
+import numpy as np
+
+# Above this QBER no secret key can be distilled against intercept-resend (BB-84 bound)
+QBER_LIMIT = 0.11
+
+
+def binary_entropy(p):
+    if p <= 0 or p >= 1:
+        return 0.0
+    return -p * math.log2(p) - (1 - p) * math.log2(1 - p)
+
+def estimate_qber(rng, alice, bob, sample_fraction=0.1):
+    # Alice and Bob publicly compare a random sample of the sifted key, which is then discarded
+    sample = rng.random(alice.size) < sample_fraction
+    sampled = int(np.count_nonzero(sample))
+    qber = np.count_nonzero(alice[sample] != bob[sample]) / sampled if sampled else 0.0
+    return qber, alice[~sample], bob[~sample]
+
+def block_parities(bits, block_size):
+    # Parity of each consecutive block, the last one possibly shorter
+    padded = np.zeros(-(-bits.size // block_size) * block_size, dtype=np.uint8)
+    padded[:bits.size] = bits
+    return np.bitwise_xor.reduce(padded.reshape(-1, block_size), axis=1)
+
+def _binary_search(alice, bob, indices):
+    # BINARY from Cascade: halve the block, asking Alice for one parity per step, until the error is isolated
+    disclosed = 0
+    while indices.size > 1:
+        half = indices[:indices.size // 2]
+        disclosed += 1
+        if np.bitwise_xor.reduce(alice[half]) != np.bitwise_xor.reduce(bob[half]):
+            indices = half
+        else:
+            indices = indices[indices.size // 2:]
+    return int(indices[0]), disclosed
+
+def cascade(rng, alice, bob, qber, passes=4):
+    # Returns Bob's corrected key and the number of parity bits disclosed over the public channel
+    n = alice.size
+    bob = bob.copy()
+    first_block = max(4, int(0.73 / max(qber, 1e-6)))
+    leaked = 0
+
+    # Per pass: bit order, position of every bit in that order, and block size
+    shuffles = []
+    for pass_index in range(passes):
+        block_size = max(1, min(n, first_block * 2 ** pass_index))
+        order = np.arange(n) if pass_index == 0 else rng.permutation(n)
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+        shuffles.append((order, position, block_size))
+
+        alice_parities = block_parities(alice[order], block_size)
+        leaked += alice_parities.size
+        wrong = np.flatnonzero(alice_parities != block_parities(bob[order], block_size))
+
+        # Correcting a bit flips the parity of the blocks holding it in every other pass, so those are revisited
+        queue = [(pass_index, int(block)) for block in wrong]
+        while queue:
+            queue_pass, block = queue.pop()
+            queue_order, _, queue_size = shuffles[queue_pass]
+            indices = queue_order[block * queue_size:(block + 1) * queue_size]
+            # Alice's parity for this block is already public, so rechecking it leaks nothing new
+            if np.bitwise_xor.reduce(alice[indices]) == np.bitwise_xor.reduce(bob[indices]):
+                continue
+            error, disclosed = _binary_search(alice, bob, indices)
+            leaked += disclosed
+            bob[error] ^= 1
+            for other_pass, (_, other_position, other_size) in enumerate(shuffles):
+                if other_pass != queue_pass:
+                    queue.append((other_pass, int(other_position[error] // other_size)))
+
+    return bob, leaked
+
+def toeplitz_hash(rng, bits, output_size):
+    # y = T x (mod 2) for a random binary Toeplitz matrix T (output_size x n) given by n + output_size - 1 seed bits
+    # T[i, j] = seed[i - j + n - 1], so y is a slice of the convolution seed * x, done with FFTs in O(n log n)
+    n = bits.size
+    seed = rng.integers(0, 2, size=n + output_size - 1, dtype=np.uint8)
+    length = seed.size + n - 1
+    fft_size = 1 << (length - 1).bit_length()
+    convolution = np.fft.irfft(np.fft.rfft(seed, fft_size) * np.fft.rfft(bits, fft_size), fft_size)
+    return (np.rint(convolution[n - 1:n - 1 + output_size]).astype(np.int64) & 1).astype(np.uint8)
+
+def secret_key_length(n, qber, leaked, security_bits=64):
+    # n (1 - h(QBER)) bits survive Eve's information, minus what reconciliation disclosed and a security margin
+    return max(0, int(math.floor(n * (1 - binary_entropy(qber)) - leaked - 2 * security_bits)))
+
+def postprocess(rng, alice, bob, sample_fraction=0.1, passes=4, security_bits=64):
+    # Runs every stage on one sifted block, returning the final key and per-stage (seconds, bits in) figures
+    stages = dict()
+
+    start = time.perf_counter()
+    qber, alice, bob = estimate_qber(rng, alice, bob, sample_fraction)
+    stages["estimation"] = (time.perf_counter() - start, alice.size)
+    if qber > QBER_LIMIT:
+        return {"qber": qber, "aborted": True, "key": np.zeros(0, dtype=np.uint8), "leaked": 0,
+                "residual_errors": None, "stages": stages}
+    if alice.size == 0:
+        # Nothing left after sampling (a tiny trailing chunk): no key, and nothing disclosed
+        return {"qber": qber, "aborted": False, "key": np.zeros(0, dtype=np.uint8), "leaked": 0,
+                "residual_errors": 0, "stages": stages}
+
+    start = time.perf_counter()
+    bob, leaked = cascade(rng, alice, bob, qber, passes)
+    stages["reconciliation"] = (time.perf_counter() - start, alice.size)
+    residual_errors = int(np.count_nonzero(alice != bob))
+
+    start = time.perf_counter()
+    key = toeplitz_hash(rng, alice, secret_key_length(alice.size, qber, leaked, security_bits))
+    stages["amplification"] = (time.perf_counter() - start, alice.size)
+
+    return {"qber": qber, "aborted": False, "key": key, "leaked": leaked,
+            "residual_errors": residual_errors, "stages": stages}
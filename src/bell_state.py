@@ -1,14 +1,14 @@
 import argparse
+import json
 import textwrap
 
 from qiskit import QuantumCircuit, QuantumRegister
 
-from qiskit.tools.visualization import plot_state_qsphere
 from qiskit.quantum_info import Statevector
 
-import matplotlib.pyplot as plt
+from instrumentation import span
 
-def main(qubit1, qubit0):
+def main(qubit1, qubit0, headless=False):
     # Simple bell state creation
     qc = QuantumCircuit(QuantumRegister(1, "q0"), QuantumRegister(1, "q1"))
 
@@ -21,23 +21,33 @@ def main(qubit1, qubit0):
     qc.h(1)
     qc.cx(1, 0)
 
-    # Plot in mpl
-    qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
+    formula = f"Psi_[{qubit1}{qubit0}] = (1/sqrt(2))*(|0{qubit0}> {'+' if qubit1 == 0 else '-'} |1{1^qubit0}>)"
+    with span("statevector"):
+        state = Statevector(qc)
 
-    # Plot QSphere (not described in paper, but can be found in qiskit. Generally too complicated, but useful here)
-    print(f"Psi_[{qubit1}{qubit0}] = (1/sqrt(2))*(|0{qubit0}> {'+' if qubit1 == 0 else '-'} |1{1^qubit0}>)")
-
-    state = Statevector(qc)
-    plot_state_qsphere(state)
-    plt.show()
+    # Headless: no drawing, the state goes out as JSON with amplitudes as [real, imaginary] pairs
+    if headless:
+        print(json.dumps({"state": formula, "amplitudes": [[z.real, z.imag] for z in state.data.tolist()]}))
+        return
 
+    import matplotlib.pyplot as plt
+    from qiskit.tools.visualization import plot_state_qsphere
 
+    # Plot in mpl
+    with span("draw"):
+        qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
 
+    # Plot QSphere (not described in paper, but can be found in qiskit. Generally too complicated, but useful here)
+    print(formula)
 
+    with span("plot_qsphere"):
+        plot_state_qsphere(state)
+    plt.show()
 
-if __name__ == "__main__":
+def build_parser(prog=None):
     # Script instruction
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=textwrap.dedent(
         """
         This script generates Bell states Psi_[ij] as shown in the thesis \n
@@ -50,11 +60,15 @@ if __name__ == "__main__":
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-q1', nargs=1, default=0, type=int, choices=[0, 1], help='State of qubit q1')
     parser.add_argument('-q0', nargs=1, default=0, type=int, choices=[0, 1], help='State of qubit q0')
-    args = parser.parse_args()
+    parser.add_argument('--headless', action='store_true', help='Batch mode: no drawing or plots, state printed as JSON')
+    return parser
 
+def run(args):
     # Unpack the arguments
     q1 = args.q1[0]
     q0 = args.q0[0]
 
-    main(q1, q0)
+    main(q1, q0, args.headless)
 
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,259 @@
+import argparse
+import json
+import math
+import os
+import platform
+import secrets
+import subprocess
+import sys
+import textwrap
+import time
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# Case -> parameter values of its scaling curve, full and --quick
+# Matrix-oracle Shor is tracked apart: N = 21 already takes minutes to build and transpile
+CASES = {
+    "shor_order": ([15, 21, 33, 35, 39, 51], [15, 21]),
+    "shor_order_matrix": ([15, 21], [15]),
+    "qpe": ([2, 4, 6, 8, 10, 12], [2, 4, 6]),
+    "qft": ([4, 8, 12, 16, 20], [4, 8, 12]),
+    "bb84": ([10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8], [10 ** 5, 10 ** 6]),
+    "rsa": ([512, 1024, 1536, 2048], [512, 1024]),
+    "elgamal": ([1024, 2048, 3072], [1024, 2048]),
+}
+
+
+class Stopwatch:
+    # Best time of each named stage over the repeats
+    def __init__(self):
+        self.stages = dict()
+
+    def time(self, stage, function, *args):
+        start = time.perf_counter()
+        value = function(*args)
+        elapsed = time.perf_counter() - start
+        self.stages[stage] = min(elapsed, self.stages.get(stage, elapsed))
+        return value
+
+def bench_shor_order(watch, N, oracle="permutation"):
+    import shor_order
+    from backend_selection import prepare
+    from power_cache import default_cache
+    from qiskit import Aer, transpile
+
+    # Smallest base coprime to N, so that every N runs the same kind of circuit
+    a = next(a for a in range(2, N) if math.gcd(a, N) == 1)
+    default_cache.clear()
+    simulator = Aer.get_backend('aer_simulator')
+    qc = watch.time("build", shor_order.build_circuit, a, N, oracle)
+    transpiled = watch.time("transpile", transpile, qc, simulator)
+    circuit, decision = prepare(transpiled)
+    watch.time("run", lambda: simulator.run(circuit, shots=1024, **decision["options"]).result())
+
+def bench_shor_order_matrix(watch, N):
+    bench_shor_order(watch, N, "matrix")
+
+def bench_qpe(watch, eval_qubits):
+    import qpe
+    from backend_selection import prepare
+    from power_cache import default_cache
+    from qiskit import Aer, transpile
+
+    U, phi = qpe.get_operator()
+    default_cache.clear()
+    simulator = Aer.get_backend('aer_simulator')
+    qc = watch.time("build", qpe.build_circuit, U, phi, eval_qubits)
+    transpiled = watch.time("transpile", transpile, qc, simulator)
+    circuit, decision = prepare(transpiled)
+    watch.time("run", lambda: simulator.run(circuit, shots=1024, **decision["options"]).result())
+
+def bench_qft(watch, qubits):
+    from qiskit import QuantumCircuit
+    from qiskit.circuit.library import QFT
+    from qiskit.quantum_info import Statevector
+
+    def build():
+        # Same circuit as qft.py: QFT of the basis state |1...1>
+        qc = QuantumCircuit(qubits)
+        qc.x(range(qubits))
+        qc.append(QFT(num_qubits=qubits, name='QFT'), list(range(qubits)))
+        return qc
+
+    qc = watch.time("build", build)
+    watch.time("statevector", Statevector, qc)
+
+def bench_bb84(watch, key_size):
+    import numpy as np
+    import bb84
+
+    rng = np.random.default_rng(0)
+    key, _, _, key_line, match = watch.time("exchange", bb84.exchange_packed, rng, key_size)
+    watch.time("sift", lambda: (bb84.sift_packed(key, match, key_size), bb84.sift_packed(key_line, match, key_size)))
+
+def bench_rsa(watch, bits):
+    import rsa
+    from number_theory import mod_inverse
+
+    # bits is the size of each prime, as in rsa.generate_primes
+    p, q = watch.time("keygen_primes", rsa.generate_primes, bits)
+    while not rsa.usable_primes(p, q, 65537):
+        p, q = rsa.generate_primes(bits)
+    b = watch.time("keygen_inverse", mod_inverse, 65537, (p - 1) * (q - 1))
+    key = watch.time("keygen_key", rsa.generate_private_key, p, q, 65537, b)
+    x = secrets.randbelow(key.N)
+    y = watch.time("encrypt", pow, x, key.a, key.N)
+    watch.time("decrypt_crt", rsa.decrypt, y, key)
+    watch.time("decrypt_plain", rsa.decrypt_plain, y, key)
+
+def bench_elgamal(watch, bits):
+    import elgamal
+    import fixed_base
+    import primes
+
+    # The 1024-bit point is the RFC 5114 group; larger sizes use a random prime and alpha = 2, fine for timing
+    if bits == 1024:
+        p, alpha = elgamal.RFC5114_P, elgamal.RFC5114_ALPHA
+    else:
+        p, alpha = primes.random_prime(bits), 2
+    r = 2 + secrets.randbelow(p - 3)
+    beta = watch.time("keygen", pow, alpha, r, p)
+    x = 2 + secrets.randbelow(p - 3)
+    y1, y2 = watch.time("encrypt", elgamal.encrypt, x, p, alpha, beta, None, False)
+    # Fixed-base path: building the recipient's table (beta is new every repeat, so never cached), then an
+    # encryption once both tables are in memory. Kept off disk, as the larger points use a throwaway prime
+    watch.time("table_build", fixed_base.get_table, beta, p)
+    fixed_base.get_table(alpha, p)
+    elgamal.encrypt(x, p, alpha, beta, None, True)  # Counts beta's first use, so the next call takes its table
+    watch.time("encrypt_tables", elgamal.encrypt, x, p, alpha, beta, None, True)
+    watch.time("decrypt", elgamal.decrypt, y1, y2, r, p)
+
+def run_case(case, param, repeat=3):
+    # Runs inside the child process: best stage times over the repeats, then this process's peak RSS
+    from instrumentation import peak_rss_kb
+
+    watch = Stopwatch()
+    for _ in range(repeat):
+        globals()[f"bench_{case}"](watch, param)
+    return {"case": case, "param": param, "seconds": watch.stages, "total": sum(watch.stages.values()),
+            "peak_rss_kb": peak_rss_kb()}
+
+def measure(case, param, repeat=3, timeout=None):
+    # One fresh interpreter per point, so peak RSS belongs to that point alone
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", case, str(param), "--repeat", str(repeat)]
+    try:
+        process = subprocess.run(command, cwd=SRC, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"case": case, "param": param, "error": f"Timed out after {timeout} s"}
+    if process.returncode != 0:
+        # A child killed outright (e.g. SIGKILL when out of memory) leaves no traceback on stderr
+        lines = process.stderr.strip().splitlines()
+        if lines:
+            error = lines[-1]
+        elif process.returncode < 0:
+            error = f"Killed by signal {-process.returncode}"
+        else:
+            error = f"Exited with code {process.returncode}"
+        return {"case": case, "param": param, "error": error}
+    return json.loads(process.stdout)
+
+def compare(results, baseline, threshold=0.2, floor=0.01):
+    # A stage regresses when it is more than threshold slower than the baseline and at least floor seconds slower
+    # RSS regresses on the same relative threshold
+    previous = {(entry["case"], entry["param"]): entry for entry in baseline["results"] if "error" not in entry}
+    regressions = []
+    for entry in results:
+        old = previous.get((entry["case"], entry["param"]))
+        if old is None or "error" in entry:
+            continue
+        for stage, seconds in entry["seconds"].items():
+            before = old["seconds"].get(stage)
+            if before is not None and seconds > before * (1 + threshold) and seconds - before > floor:
+                regressions.append((entry["case"], entry["param"], stage, before, seconds))
+        if entry["peak_rss_kb"] and old["peak_rss_kb"] and entry["peak_rss_kb"] > old["peak_rss_kb"] * (1 + threshold):
+            regressions.append((entry["case"], entry["param"], "peak_rss_kb", old["peak_rss_kb"], entry["peak_rss_kb"]))
+    return regressions
+
+def main(cases, quick=False, repeat=3, output=None, baseline=None, threshold=0.2, timeout=None):
+    results = []
+    for case in cases:
+        for param in CASES[case][1 if quick else 0]:
+            entry = measure(case, param, repeat, timeout)
+            results.append(entry)
+            if "error" in entry:
+                print(f"{case:<18} {param:>10} | {entry['error']}")
+            else:
+                stages = ", ".join(f"{stage} {seconds:.4f}" for stage, seconds in entry["seconds"].items())
+                memory = f"{entry['peak_rss_kb'] / 1024:8.1f} MB" if entry["peak_rss_kb"] is not None else "       ? MB"
+                print(f"{case:<18} {param:>10} | {memory} | {stages}")
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "quick": quick,
+        "repeat": repeat,
+        "results": results,
+    }
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+
+    regressions = []
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), threshold)
+        print(f"{len(regressions)} regressions against {baseline} (threshold {threshold:.0%})")
+        for case, param, stage, before, after in regressions:
+            print(f"  {case} {param} {stage}: {before:.4g} -> {after:.4g}")
+    return report, regressions
+
+def case_name(name):
+    if name not in CASES:
+        raise argparse.ArgumentTypeError(f"unknown case {name}")
+    return name
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+            """
+            Benchmark suite: scaling curves of every algorithm in this package \n
+            Each point runs in its own process and records the best wall time of every stage and the peak RSS \n
+            Results can be saved as JSON and compared with a saved baseline, exiting with status 1 on regressions
+            """),
+        epilog=textwrap.dedent(
+            """
+            Example usages:
+            python src/benchmarks.py --quick -o baseline.json
+            python src/benchmarks.py --quick --baseline baseline.json
+            python src/benchmarks.py rsa elgamal -o crypto.json
+            """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('cases', nargs='*', type=case_name, help=f"Cases to run, among {', '.join(CASES)}. Defaults to all")
+    parser.add_argument('--quick', action='store_true', help='Shorter scaling curves, for a fast check')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Repeats per point, best one kept. Defaults to 3')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON file for the results')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown counted as a regression. Defaults to 0.2')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds allowed per point')
+    parser.add_argument('--run-case', nargs=2, default=None, help=argparse.SUPPRESS)
+    return parser
+
+def run(args):
+    if args.run_case is not None:
+        # Child process of measure()
+        case, param = args.run_case
+        print(json.dumps(run_case(case, int(param), args.repeat)))
+        return
+
+    _, regressions = main(args.cases or list(CASES), args.quick, args.repeat, args.output, args.baseline,
+                          args.threshold, args.timeout)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,159 @@
+"""
+Content-addressed on-disk cache of transpiled circuits, stored as QPY files
+Keys combine the script, its parameters, the qiskit version and the backend, so a repeated run with the same
+inputs skips circuit construction and transpile entirely. Least recently used files are evicted past a size limit
+"""
+import hashlib
+import json
+import os
+
+import qiskit
+from qiskit import qpy, transpile
+from qiskit.circuit import Gate
+from qiskit.circuit.library import MCXGate
+from qiskit.extensions.quantum_initializer import DiagonalGate
+
+from instrumentation import span
+
+CACHE_DIR = os.path.join(os.environ.get("PFCF_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pfcf_codes")),
+                         "circuits")
+# Total size allowed for the cache, in bytes
+MAX_BYTES = int(os.environ.get("PFCF_CIRCUIT_CACHE_BYTES", 512 * 1024 ** 2))
+# Backend instructions QPY writes but cannot read back: DiagonalGate and the multi-controlled "mc*" gates are rebuilt
+# without their size arguments. Multi-controlled X and diagonal gates, which Aer runs natively and which keep the
+# oracles compact, are stored as opaque stand-ins and rebuilt on load. The other mc* gates are kept out of the basis
+MCX_GATES = ("mcx", "mcx_gray")
+STAND_IN_MCX = "pfcf_mcx"
+STAND_IN_DIAGONAL = "pfcf_diagonal"
+# Part of every key: circuits stored by an older version of this module are never loaded
+CACHE_FORMAT = 2
+
+
+def backend_name(backend):
+    # BackendV1 exposes name() as a method, BackendV2 as an attribute
+    return backend.name() if callable(backend.name) else backend.name
+
+def cache_basis(backend):
+    return [gate for gate in backend.configuration().basis_gates if gate in MCX_GATES or not gate.startswith("mc")]
+
+def _replace_gates(circuit, replace):
+    # Copy of circuit with every operation passed through replace(operation)
+    replaced = circuit.copy_empty_like()
+    for instruction in circuit.data:
+        replaced.append(replace(instruction.operation), instruction.qubits, instruction.clbits)
+    return replaced
+
+def _to_stand_in(operation):
+    if operation.name in MCX_GATES:
+        stand_in = Gate(STAND_IN_MCX, operation.num_qubits, [float(operation.ctrl_state)])
+    elif operation.name == "diagonal":
+        # Gate parameters must be real: real and imaginary parts interleaved
+        stand_in = Gate(STAND_IN_DIAGONAL, operation.num_qubits,
+                        [float(part) for value in operation.params for part in (value.real, value.imag)])
+    else:
+        return operation
+    stand_in.condition = operation.condition
+    return stand_in
+
+def _from_stand_in(operation):
+    if operation.name == STAND_IN_MCX:
+        gate = MCXGate(operation.num_qubits - 1, ctrl_state=int(operation.params[0]))
+    elif operation.name == STAND_IN_DIAGONAL:
+        parts = [float(part) for part in operation.params]
+        gate = DiagonalGate([complex(real, imag) for real, imag in zip(parts[::2], parts[1::2])])
+    else:
+        return operation
+    gate.condition = operation.condition
+    return gate
+
+def cache_key(script, params, backend):
+    versions = getattr(qiskit, "__qiskit_version__", None)
+    description = {
+        "format": CACHE_FORMAT,
+        "script": script,
+        "params": params,
+        "qiskit": dict(versions) if versions is not None else qiskit.__version__,
+        "backend": backend_name(backend),
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+def load(key, directory=CACHE_DIR):
+    path = os.path.join(directory, f"{key}.qpy")
+    try:
+        with open(path, "rb") as f:
+            circuit = _replace_gates(qpy.load(f)[0], _from_stand_in)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Truncated file or one QPY cannot parse: drop it and rebuild
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return None
+    # Access time for the LRU eviction, kept in mtime since atime is often disabled
+    # Another process may have evicted the file since it was read, which leaves the loaded circuit valid
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return circuit
+
+def store(key, circuit, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{key}.qpy")
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        qpy.dump(_replace_gates(circuit, _to_stand_in), f)
+    # Only publish files that load back, so a circuit QPY cannot represent is rebuilt instead of failing every run
+    try:
+        with open(temporary, "rb") as f:
+            _replace_gates(qpy.load(f)[0], _from_stand_in)
+    except Exception:
+        os.remove(temporary)
+        return
+    os.replace(temporary, path)
+    evict(directory, max_bytes)
+
+def evict(directory=CACHE_DIR, max_bytes=MAX_BYTES):
+    # Remove least recently used files until the cache fits in max_bytes
+    entries = [entry for entry in os.scandir(directory) if entry.name.endswith(".qpy")]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def cached_transpile(script, params, build, backend, enabled=True, directory=CACHE_DIR):
+    # Returns (transpiled circuit, built circuit). The built circuit is None on a cache hit, since build() is skipped
+    # Both paths transpile to the same basis, so --no-cache runs the same circuit as a cached run
+    if not enabled:
+        with span("build", script=script):
+            qc = build()
+        with span("transpile", script=script) as transpile_span:
+            transpiled = transpile(qc, backend, basis_gates=cache_basis(backend))
+            transpile_span.circuit(transpiled)
+        return transpiled, qc
+    key = cache_key(script, params, backend)
+    with span("circuit_cache.load", script=script) as load_span:
+        transpiled = load(key, directory)
+        load_span.set(hit=transpiled is not None)
+    if transpiled is not None:
+        load_span.circuit(transpiled)
+        return transpiled, None
+    with span("build", script=script):
+        qc = build()
+    with span("transpile", script=script) as transpile_span:
+        transpiled = transpile(qc, backend, basis_gates=cache_basis(backend))
+        transpile_span.circuit(transpiled)
+    try:
+        with span("circuit_cache.store", script=script):
+            store(key, transpiled, directory)
+    except OSError:
+        pass  # Read-only cache: the circuit is still good for this run
+    return transpiled, qc
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import textwrap
+import time
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# Headless invocations whose startup matters on batch workers. Each is a fresh interpreter, so every run is a cold start
+COMMANDS = {
+    "bell_state": ["bell_state.py", "-q1", "1", "-q0", "0", "--headless"],
+    "qft": ["qft.py", "7", "--headless"],
+    "qpe": ["qpe.py", "-n", "3", "--headless"],
+    "shor_order": ["shor_order.py", "-a", "7", "-N", "15", "--headless"],
+    "shor_order_numpy": ["shor_order.py", "-a", "7", "-N", "15", "--engine", "numpy", "--headless"],
+    "test_script": ["test_script.py", "--headless"],
+}
+
+
+def measure(command, repeats=5):
+    # Wall time of whole invocations, in seconds
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *command], cwd=SRC, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def import_profile(script, top=10):
+    # Slowest imports of a module by cumulative time, from python -X importtime
+    module = os.path.splitext(script)[0]
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             cwd=SRC, capture_output=True, text=True, check=True)
+    entries = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+def main(names, repeats=5, profile=False):
+    results = dict()
+    for name in names:
+        times = measure(COMMANDS[name], repeats)
+        results[name] = {"min": min(times), "median": statistics.median(times)}
+        if profile:
+            results[name]["imports"] = import_profile(COMMANDS[name][0])
+    print(json.dumps(results, indent=2))
+    return results
+
+def invocation_name(name):
+    if name not in COMMANDS:
+        raise argparse.ArgumentTypeError(f"unknown invocation {name}")
+    return name
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+            """
+            Measures cold-start wall time of the scripts in headless mode, one fresh interpreter per run \n
+            Results are printed as JSON, in seconds
+            """),
+        epilog=textwrap.dedent(
+            """
+            Example usages:
+            python src/cold_start.py
+            python src/cold_start.py qpe shor_order -r 10 --profile
+            """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('names', nargs='*', type=invocation_name, help=f"Invocations to measure, among {', '.join(COMMANDS)}. Defaults to all")
+    parser.add_argument('-r', '--repeats', type=int, default=5, help='Runs per invocation. Defaults to 5')
+    parser.add_argument('--profile', action='store_true', help='Also list the slowest imports of each script')
+    return parser
+
+def run(args):
+    main(args.names or list(COMMANDS), args.repeats, args.profile)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
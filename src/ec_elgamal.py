@@ -0,0 +1,307 @@
+import argparse
+import re
+import secrets
+import textwrap
+import time
+
+import elgamal
+from instrumentation import span
+
+# NIST P-256 (secp256r1): y^2 = x^3 + a x + b over F_p, base point G of prime order n
+P256_P = 0xffffffff00000001000000000000000000000000ffffffffffffffffffffffff
+P256_A = P256_P - 3
+P256_B = 0x5ac635d8aa3a93e7b3ebbd55769886bc651d06b0cc53b0f63bce3c3e27d2604b
+P256_G = (0x6b17d1f2e12c4247f8bce6e563a440f277037d812deb33a0f4a13945d898c296,
+          0x4fe342e2fe1a7f9b8ee7eb4a7c0f9e162bce33576b315ececbb6406837bf51f5)
+P256_N = 0xffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551
+
+# Bits left free at the bottom of x when a message is mapped to a point (Koblitz encoding)
+ENCODING_BITS = 8
+
+# Points are affine (x, y) tuples, or None for the point at infinity
+# Internally they are Jacobian (X, Y, Z) with x = X/Z^2 and y = Y/Z^3, so no inversions are needed until the end
+
+
+def to_jacobian(point):
+    return None if point is None else (point[0], point[1], 1)
+
+def to_affine(point, p=P256_P):
+    if point is None:
+        return None
+    X, Y, Z = point
+    z_inverse = pow(Z, -1, p)
+    z_inverse_2 = z_inverse * z_inverse % p
+    return X * z_inverse_2 % p, Y * z_inverse_2 * z_inverse % p
+
+def jacobian_double(point, p=P256_P):
+    # dbl-2001-b, valid for a = -3
+    if point is None or point[1] == 0:
+        return None
+    X, Y, Z = point
+    delta = Z * Z % p
+    gamma = Y * Y % p
+    beta = X * gamma % p
+    alpha = 3 * (X - delta) * (X + delta) % p
+    X3 = (alpha * alpha - 8 * beta) % p
+    Z3 = ((Y + Z) ** 2 - gamma - delta) % p
+    Y3 = (alpha * (4 * beta - X3) - 8 * gamma * gamma) % p
+    return X3, Y3, Z3
+
+def jacobian_add(point_1, point_2, p=P256_P):
+    # add-2007-bl
+    if point_1 is None:
+        return point_2
+    if point_2 is None:
+        return point_1
+    X1, Y1, Z1 = point_1
+    X2, Y2, Z2 = point_2
+    Z1Z1 = Z1 * Z1 % p
+    Z2Z2 = Z2 * Z2 % p
+    U1 = X1 * Z2Z2 % p
+    U2 = X2 * Z1Z1 % p
+    S1 = Y1 * Z2 * Z2Z2 % p
+    S2 = Y2 * Z1 * Z1Z1 % p
+    if U1 == U2:
+        return jacobian_double(point_1, p) if S1 == S2 else None
+    H = U2 - U1
+    I = (2 * H) ** 2 % p
+    J = H * I % p
+    r = 2 * (S2 - S1) % p
+    V = U1 * I % p
+    X3 = (r * r - J - 2 * V) % p
+    Y3 = (r * (V - X3) - 2 * S1 * J) % p
+    Z3 = ((Z1 + Z2) ** 2 - Z1Z1 - Z2Z2) * H % p
+    return X3, Y3, Z3
+
+def scalar_multiply(k, point, window=4, p=P256_P):
+    # k x point with a fixed window: 2^w - 1 precomputed multiples, then w doublings and one addition per window
+    if point is None or k == 0:
+        return None
+    base = to_jacobian(point)
+    table = [None, base]
+    for _ in range(2, 1 << window):
+        table.append(jacobian_add(table[-1], base, p))
+
+    result = None
+    mask = (1 << window) - 1
+    for shift in range(((k.bit_length() + window - 1) // window - 1) * window, -1, -window):
+        for _ in range(window):
+            result = jacobian_double(result, p)
+        digit = (k >> shift) & mask
+        if digit:
+            result = jacobian_add(result, table[digit], p)
+    return to_affine(result, p)
+
+def point_add(point_1, point_2, p=P256_P):
+    return to_affine(jacobian_add(to_jacobian(point_1), to_jacobian(point_2), p), p)
+
+def point_negate(point, p=P256_P):
+    return None if point is None else (point[0], (-point[1]) % p)
+
+def on_curve(point, p=P256_P, a=P256_A, b=P256_B):
+    x, y = point
+    return (y * y - (x * x * x + a * x + b)) % p == 0
+
+def encode_int_to_point(int_text, p=P256_P, a=P256_A, b=P256_B):
+    # Koblitz: try x = message * 2^8 + j until x^3 + a x + b is a square. Each try succeeds with probability ~1/2
+    # p = 3 (mod 4), so square roots are a single exponentiation
+    if int_text >= p >> ENCODING_BITS:
+        raise ValueError("Message too long for one point")
+    for j in range(1 << ENCODING_BITS):
+        x = (int_text << ENCODING_BITS) + j
+        y_squared = (x * x * x + a * x + b) % p
+        y = pow(y_squared, (p + 1) // 4, p)
+        if y * y % p == y_squared:
+            return x, y
+    raise ValueError("No point found for message")
+
+def decode_point_to_int(point):
+    return point[0] >> ENCODING_BITS
+
+def encrypt(point_m, beta, k=None):
+    # (y1, y2) = (k G, M + k beta)
+    if k is None:
+        k = 1 + secrets.randbelow(P256_N - 1)
+    return scalar_multiply(k, P256_G), point_add(point_m, scalar_multiply(k, beta))
+
+def decrypt(y1, y2, r):
+    # M = y2 - r y1
+    return point_add(y2, point_negate(scalar_multiply(r, y1)))
+
+def main(plaintext):
+
+    # KEY GENERATION
+    print("KEY GENERATION PHASE")
+    # 1)
+    print(f"""
+        1) Alice picks the standard curve P-256: y^2 = x^3 + a x + b over F_p. All further operations are in its group of points:
+        p = {P256_P}
+        a = {P256_A}
+        b = {P256_B}
+        """)
+
+    # 2)
+    print(f"""
+        2) Alice takes the standard base point G, of prime order n:
+        G = {P256_G}
+        n = {P256_N}
+        """)
+
+    # 3)
+    r = 1 + secrets.randbelow(P256_N - 1)
+    with span("ec_elgamal.keygen"):
+        beta = scalar_multiply(r, P256_G)
+    print(f"""
+        3) Alice chooses a random integer r in [1, n-1] and calculates beta = r G:
+        r    = {r}
+        beta = {beta}
+        """)
+
+    # 4)
+    print(f"""
+        4) Alice sends values (curve, G, beta) over the network and saves r for herself
+        """)
+
+    # MESSAGE EXCHANGE
+    print("MESSAGE EXCHANGE PHASE")
+    # 5)
+    print(f"""
+        5) Bob gets (curve, G, beta) and can now construct the group of points with its algebra
+        """)
+
+    # 6)
+    int_plaintext = elgamal.encode_text_to_int(plaintext)
+    if int_plaintext >= P256_P >> ENCODING_BITS:
+        print(f"""
+        6) Bob encodes his message to a number using UTF-8, then to a point M on the curve (Koblitz encoding):
+        Bob's message       = {plaintext}
+        Encoded plaintext x = {int_plaintext}
+        Fits in one point?  = False
+        """)
+        print("Message does not fit in one point of P-256 (at most 30 bytes) and cannot be encrypted. Use src/elgamal_stream.py for long messages")
+        return
+    with span("ec_elgamal.encode"):
+        point_m = encode_int_to_point(int_plaintext)
+    print(f"""
+        6) Bob encodes his message to a number using UTF-8, then to a point M on the curve (Koblitz encoding):
+        Bob's message       = {plaintext}
+        Encoded plaintext x = {int_plaintext}
+        Point M             = {point_m}
+        """)
+
+    # 7)
+    k = 1 + secrets.randbelow(P256_N - 1)
+    print(f"""
+        7) Bob chooses random integer k in [1, n-1]:
+        k = {k}
+        """)
+
+    # 8), 9)
+    with span("ec_elgamal.encrypt"):
+        y1, y2 = encrypt(point_m, beta, k)
+    print(f"""
+        8) Bob calculates ciphertext y1 = k G:
+        y1 = {y1}
+        """)
+    print(f"""
+        9) Bob calculates ciphertext y2 = M + k beta:
+        y2 = {y2}
+        """)
+
+    # 10)
+    print(f"""
+        10) Bob sends (y1, y2) over the network to Alice
+        """)
+
+    # 11)
+    with span("ec_elgamal.decrypt"):
+        point_m_line = decrypt(y1, y2, r)
+    int_plaintext_line = decode_point_to_int(point_m_line)
+    print(f"""
+        11) Alice receives (y1, y2) and calculates M' = y2 - r y1:
+        Point M'             = {point_m_line}
+        Encoded plaintext x' = {int_plaintext_line}
+        """)
+
+    # 12)
+    plaintext_line = elgamal.decode_int_to_text(int_plaintext_line) if int_plaintext_line else ""
+    print(f"""
+        12) Alice decodes her plaintext using the same encoding scheme (UTF-8 here):
+        Alice's message = {plaintext_line}
+        Equal to Bob's  = {plaintext_line == plaintext}
+        """)
+
+def benchmark(count=20):
+    # Per-operation latency: P-256 (128-bit security) against finite-field ElGamal in the 1024-bit RFC 5114 group
+    # (about 80-bit security) and in a 3072-bit prime field (about 128-bit security, same as P-256)
+    import primes  # Loads numpy, so only when benchmarking
+
+    def timed(operation):
+        start = time.perf_counter()
+        for _ in range(count):
+            operation()
+        return (time.perf_counter() - start) / count * 1e3
+
+    results = dict()
+
+    r = 1 + secrets.randbelow(P256_N - 1)
+    beta = scalar_multiply(r, P256_G)
+    point_m = encode_int_to_point(elgamal.encode_text_to_int("attack at dawn"))
+    y1, y2 = encrypt(point_m, beta)
+    results["EC P-256"] = (timed(lambda: scalar_multiply(1 + secrets.randbelow(P256_N - 1), P256_G)),
+                           timed(lambda: encrypt(point_m, beta)),
+                           timed(lambda: decrypt(y1, y2, r)))
+
+    for name, p, alpha in (("FF 1024 (RFC 5114)", elgamal.RFC5114_P, elgamal.RFC5114_ALPHA),
+                           ("FF 3072", primes.random_prime(3072), 2)):
+        r = secrets.randbelow(p - 3) + 2
+        beta = pow(alpha, r, p)
+        x = elgamal.encode_text_to_int("attack at dawn")
+        y1, y2 = elgamal.encrypt(x, p, alpha, beta, use_tables=False)
+        results[name] = (timed(lambda: pow(alpha, secrets.randbelow(p - 3) + 2, p)),
+                         timed(lambda: elgamal.encrypt(x, p, alpha, beta, use_tables=False)),
+                         timed(lambda: elgamal.decrypt(y1, y2, r, p)))
+
+    print(f"Mean latency over {count} runs, in ms")
+    print(f"{'':<20} | {'keygen':>8} | {'encrypt':>8} | {'decrypt':>8}")
+    for name, (keygen, encryption, decryption) in results.items():
+        print(f"{name:<20} | {keygen:>8.3f} | {encryption:>8.3f} | {decryption:>8.3f}")
+    return results
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+        """
+        This script implements ElGamal on the elliptic curve P-256 in order to exemplify its operation \n
+        The procedures here should be used for illustration purposes only \n
+        ** THIS IS NOT A SECURE IMPLEMENTATION OF ELGAMAL ** \n
+        """),
+        epilog=textwrap.dedent(
+        """
+        Example usages:
+        python src/ec_elgamal.py attack at dawn
+        python src/ec_elgamal.py --benchmark
+        """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('message', nargs='*', default='', type=str, help='The message to be transmitted. Only a-zA-Z0-9 characters allowed, at most 30 bytes')
+    parser.add_argument('--benchmark', action='store_true', help='Compare per-operation latency with finite-field ElGamal')
+    return parser
+
+def run(args):
+    message = args.message
+
+    # Remove non-alphanum and join with spaces for the code
+    filtered = [re.sub('[^A-Za-z0-9]+', '', part) for part in message]
+    # Remove all '' elements from list. Avoids growing list needlessly
+    filtered = list(filter(lambda a: a != '', filtered))
+    message_sent = str.join(" ",filtered)
+    # Call the ElGamal
+    if args.benchmark:
+        benchmark()
+    else:
+        main(message_sent)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
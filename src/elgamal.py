@@ -4,20 +4,17 @@ import math
 import textwrap
 import random
 
-def gcdExtended(a, b):
-    # Base Case
-    if a == 0:
-        return b, 0, 1
+import time
 
-    r, s1, t1 = gcdExtended(b % a, a)
-
-    # Update x and y using results of recursive
-    # call
-    s = t1 - (b // a) * s1
-    t = s1
-
-    return r, s, t
+from number_theory import mod_inverse, batch_mod_inverse
+from fixed_base import fixed_pow
+from instrumentation import span
 
+# 1024-bit MODP group with 160-bit prime order subgroup, from RFC 5114
+RFC5114_P = int("0xB10B8F96A080E01DDE92DE5EAE5D54EC52C99FBCFB06A3C69A6A9DCA52D23B616073E28675A23D189838EF1E2EE652C013ECB4AEA906112324975C3CD49B83BFACCBDD7D90C4BD7098488E9C219A73724EFFD6FAE5644738FAA31A4FF55BCCC0A151AF5F0DC8B4BD45BF37DF365C1A65E68CFDA76D4DA708DF1FB2BC2E4A4371".lower(),
+                base=16)
+RFC5114_ALPHA = int("0xA4D1CBD5C3FD34126765A442EFB99905F8104DD258AC507FD6406CFF14266D31266FEA1E5C41564B777E690F5504F213160217B4B01B886A5E91547F9E2749F4D7FBD7D3B9A92EE1909D0D2263F80A76A6A24C087A091F531DBF0A0169B6A28AD662A4D18E73AFA32D779D5918D08BC8858F4DCEF97C2A24855E6EEB22B3B2E5".lower(),
+                    base=16)
 
 def encode_text_to_int(text):
     # Default encoding is UTF-8
@@ -29,14 +26,63 @@ def decode_int_to_text(decimal_number):
     # Default encoding is UTF-8
     return decimal_number.to_bytes(byte_length, byteorder='big').decode()
 
+def encrypt(int_plaintext, p, alpha, beta, m=None, use_tables=True):
+    # (y1, y2) = (alpha^m, x otimes beta^m). alpha is fixed, so its table is used from the start,
+    # while the recipient's beta gets one from its second encryption on
+    if m is None:
+        m = random.randint(2, p-1)
+    if use_tables:
+        int_ciphertext_1 = fixed_pow(alpha, m, p, persist=True)
+        int_ciphertext_2 = (int_plaintext * fixed_pow(beta, m, p, build_after=1)) % p
+    else:
+        int_ciphertext_1 = pow(alpha, m, p)
+        int_ciphertext_2 = (int_plaintext * pow(beta, m, p)) % p
+    return int_ciphertext_1, int_ciphertext_2
+
+def benchmark(count=200):
+    # Encryptions per second to a single recipient, with and without fixed-base tables
+    p, alpha = RFC5114_P, RFC5114_ALPHA
+    beta = pow(alpha, random.randint(2, p-1), p)
+    x = encode_text_to_int("attack at dawn")
+    exponents = [random.randint(2, p-1) for _ in range(count)]
+
+    start = time.perf_counter()
+    for m in exponents:
+        encrypt(x, p, alpha, beta, m, use_tables=False)
+    plain = count / (time.perf_counter() - start)
+
+    # The first call loads or builds the tables, and is timed separately
+    start = time.perf_counter()
+    encrypt(x, p, alpha, beta, exponents[0])
+    encrypt(x, p, alpha, beta, exponents[0])
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for m in exponents:
+        encrypt(x, p, alpha, beta, m)
+    tables = count / (time.perf_counter() - start)
+
+    print(f"ElGamal encryption to one recipient, {count} messages, {p.bit_length()}-bit p:")
+    print(f"Without tables: {plain:9.1f} encryptions/s")
+    print(f"With tables   : {tables:9.1f} encryptions/s ({tables / plain:.2f}x, {setup:.3f} s to load or build tables)")
+    return plain, tables
+
+def decrypt(int_ciphertext_1, int_ciphertext_2, r, p):
+    # x' = y2 otimes (y1^r)^-1
+    return (int_ciphertext_2 * mod_inverse(pow(int_ciphertext_1, r, p), p)) % p
+
+def decrypt_batch(ciphertexts, r, p):
+    # Same as decrypt for many (y1, y2) pairs, sharing a single modular inverse among all of them
+    inverses = batch_mod_inverse([pow(int_ciphertext_1, r, p) for int_ciphertext_1, _ in ciphertexts], p)
+    return [(int_ciphertext_2 * inverse) % p for (_, int_ciphertext_2), inverse in zip(ciphertexts, inverses)]
+
 def main(plaintext):
 
     # KEY GENERATION
     print("KEY GENERATION PHASE")
     # 1)
     # Using ElGamal with 1024 bit prime. Non-random for simplicity. From RFC 5114
-    p = int("0xB10B8F96A080E01DDE92DE5EAE5D54EC52C99FBCFB06A3C69A6A9DCA52D23B616073E28675A23D189838EF1E2EE652C013ECB4AEA906112324975C3CD49B83BFACCBDD7D90C4BD7098488E9C219A73724EFFD6FAE5644738FAA31A4FF55BCCC0A151AF5F0DC8B4BD45BF37DF365C1A65E68CFDA76D4DA708DF1FB2BC2E4A4371".lower(),
-            base=16)
+    p = RFC5114_P
     print(f"""
         1) Alice generates large prime p. All further operations are now in cyclic group (Z_p^*, otimes):
         p = {p}
@@ -44,8 +90,7 @@ def main(plaintext):
 
     # 2)
     # Also non-random for simplicity. From RFC 5114
-    alpha = int("0xA4D1CBD5C3FD34126765A442EFB99905F8104DD258AC507FD6406CFF14266D31266FEA1E5C41564B777E690F5504F213160217B4B01B886A5E91547F9E2749F4D7FBD7D3B9A92EE1909D0D2263F80A76A6A24C087A091F531DBF0A0169B6A28AD662A4D18E73AFA32D779D5918D08BC8858F4DCEF97C2A24855E6EEB22B3B2E5".lower(),
-            base=16)
+    alpha = RFC5114_ALPHA
     print(f"""
         2) Alice finds a generator alpha of (Z_p^*, otimes):
         alpha = {alpha}
@@ -54,7 +99,8 @@ def main(plaintext):
 
     # 3)
     r = random.randint(2, p-1) # Limited to avoid trivial cases
-    beta = pow(alpha, r, p)
+    with span("elgamal.keygen"):
+        beta = pow(alpha, r, p)
     print(f"""
         3) Alice chooses a random element r in Z_p^* and calculates beta = alpha^r:
         r    = {r}
@@ -91,14 +137,14 @@ def main(plaintext):
         """)
 
     # 8)
-    int_ciphertext_1 = pow(alpha, m, p)
+    with span("elgamal.encrypt"):
+        int_ciphertext_1, int_ciphertext_2 = encrypt(int_plaintext, p, alpha, beta, m)
     print(f"""
         8) Bob calculates ciphertext y1 in Z_p^* by taking y1 = alpha^m:
         Encoded ciphertext y1 = {int_ciphertext_1}
         """)
 
     # 9)
-    int_ciphertext_2 = (int_plaintext*pow(beta, m, p))%p
     print(f"""
         9) Bob calculates ciphertext y2 in Z_p^* by taking y2 = x otimes beta^m:
         Encoded ciphertext y2 = {int_ciphertext_2}
@@ -111,10 +157,8 @@ def main(plaintext):
 
 
     # 11)
-    partial = pow(int_ciphertext_1, r, p)
-    _, inverse, _ = gcdExtended(partial, p)
-    inverse = inverse % p
-    int_plaintext_line = (int_ciphertext_2 * inverse) % p
+    with span("elgamal.decrypt"):
+        int_plaintext_line = decrypt(int_ciphertext_1, int_ciphertext_2, r, p)
     print(f"""
         11) Alice receives (y1, y2) and calculates x' = y2 otimes (y1^r)^-1:
         Encoded plaintext x' = {int_plaintext_line}
@@ -128,14 +172,10 @@ def main(plaintext):
         Equal to Bob's  = {plaintext_line == plaintext}
         """)
 
-
-
-
-
-
-if __name__ == "__main__":
+def build_parser(prog=None):
     # Script instruction
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=textwrap.dedent(
         """
         This script implements the ElGamal cryptosystem in order to exemplify its operation \n
@@ -144,11 +184,16 @@ if __name__ == "__main__":
         """),
         epilog=textwrap.dedent(
         """
-        Example usage: python src/elgamal.py attack at dawn
+        Example usages:
+        python src/elgamal.py attack at dawn
+        python src/elgamal.py --benchmark
         """),
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('message', nargs='*', default='', type=str, help='The message to be transmitted. Only a-zA-Z0-9 characters allowed')
-    args = parser.parse_args()
+    parser.add_argument('--benchmark', action='store_true', help='Compare encryption throughput with and without fixed-base tables')
+    return parser
+
+def run(args):
     message = args.message
 
     # Remove non-alphanum and join with spaces for the code
@@ -157,5 +202,10 @@ if __name__ == "__main__":
     filtered = list(filter(lambda a: a != '', filtered))
     message_sent = str.join(" ",filtered)
     # Call the ElGamal
-    main(message_sent)
+    if args.benchmark:
+        benchmark()
+    else:
+        main(message_sent)
 
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,85 @@
+import secrets
+import textwrap
+
+import elgamal
+import streaming
+from fixed_base import fixed_pow
+from streaming import BlockCipher, worker_key
+
+
+def generate_key(p=elgamal.RFC5114_P, alpha=elgamal.RFC5114_ALPHA):
+    r = 2 + secrets.randbelow(p - 3)
+    return {"p": p, "alpha": alpha, "beta": pow(alpha, r, p), "r": r}
+
+def element_width(p):
+    return (p.bit_length() + 7) // 8
+
+def payload_size(p):
+    # Bytes of data per block. A 0x01 marker byte goes in front, so every block is a nonzero integer below p
+    return (p.bit_length() - 1) // 8 - 1
+
+def encode_block(chunk):
+    return int.from_bytes(b"\x01" + chunk, byteorder='big')
+
+def decode_block(int_block):
+    data = int_block.to_bytes((int_block.bit_length() + 7) // 8, byteorder='big')
+    if data[:1] != b"\x01":
+        raise ValueError("Corrupted block: missing marker byte")
+    return data[1:]
+
+def encrypt_batch(chunks):
+    # One bytes record per chunk. secrets is used because forked workers share the random module's state
+    key = worker_key()
+    p, alpha, beta = key["p"], key["alpha"], key["beta"]
+    width = element_width(p)
+    records = []
+    for chunk in chunks:
+        m = 2 + secrets.randbelow(p - 3)
+        y1 = fixed_pow(alpha, m, p, persist=True)
+        y2 = (encode_block(chunk) * fixed_pow(beta, m, p)) % p
+        records.append(y1.to_bytes(width, byteorder='big') + y2.to_bytes(width, byteorder='big'))
+    return b"".join(records)
+
+def decrypt_batch(records):
+    # Blocks of one batch share a single modular inverse (see elgamal.decrypt_batch)
+    key = worker_key()
+    p, r = key["p"], key["r"]
+    width = element_width(p)
+    ciphertexts = [(int.from_bytes(record[:width], byteorder='big'), int.from_bytes(record[width:], byteorder='big'))
+                   for record in records]
+    return b"".join(decode_block(x) for x in elgamal.decrypt_batch(ciphertexts, r, p))
+
+# Ciphertext file: magic "EGS1", 2-byte element width, then one (y1, y2) record of 2 x width bytes per block
+# (see streaming.py)
+CIPHER = BlockCipher(
+    name="ElGamal", magic=b"EGS1", elements=2,
+    width=lambda key: element_width(key["p"]),
+    payload_size=lambda key: payload_size(key["p"]),
+    public=lambda key: {"p": key["p"], "alpha": key["alpha"], "beta": key["beta"]},
+    private=lambda key: {"p": key["p"], "r": key["r"]},
+    encrypt_batch=encrypt_batch, decrypt_batch=decrypt_batch,
+    generate_key=lambda args: generate_key())
+
+def build_parser(prog=None):
+    # Script instruction
+    return streaming.build_parser(
+        prog=prog,
+        description=textwrap.dedent(
+        """
+        Encrypts and decrypts arbitrary byte streams with ElGamal over the RFC 5114 group \n
+        Input is split in blocks that fit in Z_p^*, processed in order by a pool of worker processes \n
+        ** THIS IS NOT A SECURE IMPLEMENTATION OF ELGAMAL ** \n
+        """),
+        epilog=textwrap.dedent(
+        """
+        Example usages:
+        python src/elgamal_stream.py keygen key.json
+        python src/elgamal_stream.py encrypt key.json -i big.bin -o big.egs
+        cat big.egs | python src/elgamal_stream.py decrypt key.json > big.out
+        """))
+
+def run(args):
+    streaming.run(CIPHER, args)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,126 @@
+"""
+Fixed-base exponentiation with precomputed window tables
+For a base g used over and over, g^(d 2^(w j)) is stored for every window j and digit d, so g^e takes one
+multiplication per nonzero w-bit digit of e and no squarings at all
+Tables are built lazily on first use. Only tables of fixed parameters (a group generator) are cached to disk,
+since those serve every run; a recipient's key gets an in-memory table. Both in-memory caches are bounded (LRU)
+"""
+import hashlib
+import os
+from collections import OrderedDict
+
+# Where tables are cached between runs
+CACHE_DIR = os.environ.get("PFCF_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pfcf_codes"))
+# Tables kept in memory and bases counted towards build_after. With window 6 a table holds 64 integers per window,
+# about 1.8 MB for the 1024-bit RFC 5114 group and 6.3 MB for a 2048-bit modulus (so up to 50 MB for 8 of those)
+MAX_TABLES = int(os.environ.get("PFCF_FIXED_BASE_TABLES", 8))
+MAX_USES = 4096
+
+
+class FixedBaseTable:
+    def __init__(self, base, modulus, exponent_bits, window=6, table=None):
+        self.base = base
+        self.modulus = modulus
+        self.exponent_bits = exponent_bits
+        self.window = window
+        self.windows = -(-exponent_bits // window)
+        # table[j][d] = base^(d 2^(w j)) mod modulus
+        self.table = table if table is not None else self._build()
+
+    def _build(self):
+        table = []
+        window_base = self.base % self.modulus
+        for _ in range(self.windows):
+            row = [1]
+            for _ in range(1, 1 << self.window):
+                row.append(row[-1] * window_base % self.modulus)
+            table.append(row)
+            window_base = row[-1] * window_base % self.modulus  # base^(2^(w (j + 1)))
+        return table
+
+    def pow(self, exponent):
+        # Falls back to the built-in pow for exponents the table does not cover
+        if exponent < 0 or exponent.bit_length() > self.exponent_bits:
+            return pow(self.base, exponent, self.modulus)
+        result = 1
+        mask = (1 << self.window) - 1
+        j = 0
+        while exponent:
+            digit = exponent & mask
+            if digit:
+                result = result * self.table[j][digit] % self.modulus
+            exponent >>= self.window
+            j += 1
+        return result
+
+    def key(self):
+        return table_key(self.base, self.modulus, self.exponent_bits, self.window)
+
+    def save(self, directory=CACHE_DIR):
+        # Raw fixed-width big-endian entries, row after row
+        os.makedirs(directory, exist_ok=True)
+        width = (self.modulus.bit_length() + 7) // 8
+        path = os.path.join(directory, f"{self.key()}.bin")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            for row in self.table:
+                f.write(b"".join(value.to_bytes(width, "big") for value in row))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, base, modulus, exponent_bits, window=6, directory=CACHE_DIR):
+        # None when no (complete) table is cached
+        path = os.path.join(directory, f"{table_key(base, modulus, exponent_bits, window)}.bin")
+        width = (modulus.bit_length() + 7) // 8
+        row_size = (1 << window) * width
+        windows = -(-exponent_bits // window)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) != windows * row_size:
+            return None
+        table = [[int.from_bytes(data[offset + i * width:offset + (i + 1) * width], "big") for i in range(1 << window)]
+                 for offset in range(0, len(data), row_size)]
+        return cls(base, modulus, exponent_bits, window, table)
+
+def table_key(base, modulus, exponent_bits, window):
+    return hashlib.sha1(f"{base}:{modulus}:{exponent_bits}:{window}".encode()).hexdigest()
+
+# In-memory tables and how many times each base has been used without one, least recently used first
+_tables = OrderedDict()
+_uses = OrderedDict()
+
+def _remember(cache, key, value, limit):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+def get_table(base, modulus, exponent_bits=None, window=6, persist=False, directory=CACHE_DIR):
+    # Memory first, then (with persist) the disk cache, and only then a fresh build, saved for the next run if persist
+    exponent_bits = exponent_bits or modulus.bit_length()
+    key = table_key(base, modulus, exponent_bits, window)
+    table = _tables.get(key)
+    if table is None:
+        table = FixedBaseTable.load(base, modulus, exponent_bits, window, directory) if persist else None
+        if table is None:
+            table = FixedBaseTable(base, modulus, exponent_bits, window)
+            if persist:
+                try:
+                    table.save(directory)
+                except OSError:
+                    pass  # Read-only cache: the table still works for this run
+    _remember(_tables, key, table, MAX_TABLES)
+    return table
+
+def fixed_pow(base, exponent, modulus, build_after=0, window=6, persist=False):
+    # base^exponent mod modulus, through a table once base has been used build_after times without one
+    # build_after=0 suits fixed parameters (a generator), build_after=1 a recipient's key seen for the first time
+    # persist=True caches the table on disk, for fixed parameters only: every new key would otherwise leave a file
+    uses = _uses.get((base, modulus), 0)
+    if uses < build_after:
+        _remember(_uses, (base, modulus), uses + 1, MAX_USES)
+        return pow(base, exponent, modulus)
+    return get_table(base, modulus, window=window, persist=persist).pow(exponent)
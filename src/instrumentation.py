@@ -0,0 +1,178 @@
+"""
+Context-manager spans for timing the phases of a run
+Tracing is off unless PFCF_TRACE names an output file (or enable() is called). A .json file gets a Chrome trace,
+to open in chrome://tracing or Perfetto, anything else gets one JSON object per span. Worker processes only reach
+the file in JSON-lines mode, since the Chrome trace is written when the main process exits
+While off, span() hands back one shared object that does nothing, so instrumented code pays a function call per span
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def circuit(self, qc):
+        pass
+
+    def aer_result(self, result):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.rss_before = peak_rss_kb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter()
+        rss_peak = peak_rss_kb()
+        self.tracer.stack().pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.record({
+            "name": self.name,
+            "parent": self.parent,
+            "pid": os.getpid(),
+            "start": self.start - self.tracer.origin,
+            "duration": end - self.start,
+            # ru_maxrss is the process high-water mark in KB: growth says how much this span pushed it up
+            "peak_rss_kb": rss_peak,
+            "rss_growth_kb": rss_peak - self.rss_before if rss_peak is not None else None,
+            "attributes": self.attributes,
+        })
+        return False
+
+    def set(self, **attributes):
+        # Attach results found inside the span
+        self.attributes.update(attributes)
+
+    def circuit(self, qc):
+        # Width, depth and gate counts, only computed while tracing
+        self.attributes["circuit"] = circuit_stats(qc)
+
+    def aer_result(self, result):
+        self.attributes["aer"] = result_metadata(result)
+
+class Tracer:
+    def __init__(self, path, chrome=None):
+        self.path = path
+        self.chrome = path.endswith(".json") if chrome is None else chrome
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.file = None if self.chrome else open(path, "a")
+        self.closed = False
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def record(self, event):
+        with self.lock:
+            if self.chrome:
+                self.events.append(event)
+            else:
+                self.file.write(json.dumps(event, default=str) + "\n")
+                self.file.flush()
+
+    def close(self):
+        # Only the first call writes: a Chrome trace is rewritten as a whole, so a later one could clobber a newer file
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.chrome:
+                # Complete ("X") events, timestamps in microseconds
+                trace = [{"name": event["name"], "ph": "X", "pid": event["pid"], "tid": event["pid"],
+                          "ts": event["start"] * 1e6, "dur": event["duration"] * 1e6,
+                          "args": {"peak_rss_kb": event["peak_rss_kb"], "rss_growth_kb": event["rss_growth_kb"],
+                                   **event["attributes"]}}
+                         for event in self.events]
+                if trace:
+                    with open(self.path, "w") as f:
+                        json.dump({"traceEvents": trace}, f, default=str)
+            elif self.file is not None and not self.file.closed:
+                self.file.close()
+
+_tracer = None
+
+
+def enable(path, chrome=None):
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(path, chrome)
+    return _tracer
+
+def disable():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+
+# One hook for whichever tracer is current at exit, so a tracer replaced by enable() is never written twice
+atexit.register(disable)
+
+def enabled():
+    return _tracer is not None
+
+def span(name, **attributes):
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, attributes)
+
+def peak_rss_kb():
+    # Peak resident memory of this process in KB, or None when it cannot be read
+    # resource is Unix only, and its ru_maxrss is in KB on Linux but in bytes on macOS. Elsewhere (Windows) psutil's
+    # peak working set stands in
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) // 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def circuit_stats(qc):
+    return {"width": qc.num_qubits, "clbits": qc.num_clbits, "depth": qc.depth(), "size": qc.size(),
+            "ops": dict(qc.count_ops())}
+
+def result_metadata(result):
+    # What Aer reports about a run: backend, total and per-experiment time, method, parallelism
+    metadata = {"backend": result.backend_name, "time_taken": result.time_taken, "status": result.status,
+                "metadata": getattr(result, "metadata", None)}
+    metadata["experiments"] = [{"shots": experiment.shots, "time_taken": getattr(experiment, "time_taken", None),
+                                "metadata": getattr(experiment, "metadata", None)}
+                               for experiment in result.results]
+    return metadata
+
+if os.environ.get("PFCF_TRACE"):
+    enable(os.environ["PFCF_TRACE"])
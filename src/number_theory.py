@@ -0,0 +1,96 @@
+import argparse
+import secrets
+import sys
+import textwrap
+import timeit
+
+
+def gcd_extended(a, b):
+    # Iterative extended Euclid: returns (r, s, t) with r = gcd(a, b) = s*a + t*b
+    # Same contract as the old recursive gcdExtended, without one Python frame per division step
+    old_r, r = a, b
+    old_s, s = 1, 0
+    old_t, t = 0, 1
+    while r != 0:
+        q = old_r // r
+        old_r, r = r, old_r - q * r
+        old_s, s = s, old_s - q * s
+        old_t, t = t, old_t - q * t
+    return old_r, old_s, old_t
+
+def mod_inverse(x, m):
+    # x^-1 mod m, raising ValueError when gcd(x, m) != 1
+    return pow(x, -1, m)
+
+def batch_mod_inverse(values, m):
+    # Montgomery's trick: prefix products, one modular inverse of the total, then walk back
+    # k inverses for 1 inverse plus 3(k - 1) multiplications
+    values = list(values)
+    if not values:
+        return []
+    prefix = [values[0] % m]
+    for value in values[1:]:
+        prefix.append(prefix[-1] * value % m)
+
+    inverse = mod_inverse(prefix[-1], m)
+    inverses = [0] * len(values)
+    for i in range(len(values) - 1, 0, -1):
+        inverses[i] = inverse * prefix[i - 1] % m  # (v_0...v_i)^-1 (v_0...v_i-1) = v_i^-1
+        inverse = inverse * values[i] % m          # (v_0...v_i-1)^-1
+    inverses[0] = inverse
+    return inverses
+
+def benchmark(bits=2048, count=1000, repeat=5):
+    # Compares the old recursive extended Euclid, the iterative one, pow(x, -1, m), and batch inversion
+    def gcd_extended_recursive(a, b):
+        if a == 0:
+            return b, 0, 1
+        r, s1, t1 = gcd_extended_recursive(b % a, a)
+        return r, t1 - (b // a) * s1, s1
+
+    m = secrets.randbits(bits) | (1 << (bits - 1)) | 1
+    values = [secrets.randbelow(m - 2) + 2 for _ in range(count)]
+    values = [v for v in values if gcd_extended(v, m)[0] == 1]
+
+    def best(statement):
+        return min(timeit.repeat(statement, number=1, repeat=repeat))
+
+    # The recursive version needs about 0.6 frames per bit of input, past the default limit at 2048 bits
+    timings = dict()
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 4 * bits))
+    try:
+        timings["recursive gcdExtended"] = best(lambda: [gcd_extended_recursive(v, m) for v in values])
+    finally:
+        sys.setrecursionlimit(limit)
+    timings["iterative gcd_extended"] = best(lambda: [gcd_extended(v, m) for v in values])
+    timings["pow(x, -1, m)"] = best(lambda: [mod_inverse(v, m) for v in values])
+    timings["batch_mod_inverse"] = best(lambda: batch_mod_inverse(values, m))
+    print(f"Inverting {len(values)} values modulo a {bits}-bit number (best of {repeat}):")
+    for name, seconds in timings.items():
+        print(f"{name:<23}: {seconds * 1e3:9.3f} ms ({timings['recursive gcdExtended'] / seconds:.2f}x)")
+    return timings
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+        """
+        Number theory helpers shared by rsa.py and elgamal.py: extended Euclid, modular inverse \n
+        and Montgomery's batch inversion. Running it benchmarks them \n
+        """),
+        epilog=textwrap.dedent(
+        """
+        Example usage: python src/number_theory.py --bits 2048 --count 1000
+        """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--bits', type=int, default=2048, help='Size of the modulus. Defaults to 2048')
+    parser.add_argument('--count', type=int, default=1000, help='Number of values to invert. Defaults to 1000')
+    return parser
+
+def run(args):
+    benchmark(args.bits, args.count)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import sys
+import textwrap
+import time
+
+import instrumentation
+from streaming import open_input
+
+# Subcommand -> (module, one-line help, whether the module has --headless)
+# Modules are imported only once their subcommand is chosen, so `pfcf rsa` never loads qiskit
+COMMANDS = {
+    "rsa": ("rsa", "RSA encryption example and CRT benchmark", False),
+    "rsa_keypool": ("rsa_keypool", "Fill a directory with pre-generated RSA keys", False),
+    "rsa_stream": ("rsa_stream", "Block-mode RSA over byte streams", False),
+    "primes": ("primes", "Sieve-prefiltered random prime generation", False),
+    "number_theory": ("number_theory", "Modular inversion benchmark", False),
+    "elgamal": ("elgamal", "ElGamal encryption example and fixed-base benchmark", False),
+    "elgamal_stream": ("elgamal_stream", "ElGamal over byte streams", False),
+    "ec_elgamal": ("ec_elgamal", "ElGamal on the elliptic curve P-256", False),
+    "bb84": ("bb84", "BB-84 key exchange", False),
+    "bell_state": ("bell_state", "Bell state preparation", True),
+    "qft": ("qft", "Quantum Fourier transform of a basis state", True),
+    "qpe": ("qpe", "Quantum phase estimation", True),
+    "shor_order": ("shor_order", "Quantum core of Shor's order finding", True),
+    "shor": ("shor", "Factoring with Shor's algorithm", True),
+    "shor_sweep": ("shor_sweep", "Order finding over every valid (a, N) pair of a range", False),
+    "test_script": ("test_script", "Installation check with a random Bell state", True),
+    "benchmarks": ("benchmarks", "Scaling curves of every algorithm, with baseline comparison", False),
+    "cold_start": ("cold_start", "Cold-start wall time of the headless scripts", False),
+}
+
+
+def load(command):
+    module, _, _ = COMMANDS[command]
+    return importlib.import_module(module)
+
+def run_command(command, argv):
+    module = load(command)
+    return module.run(module.build_parser(prog=f"pfcf {command}").parse_args(argv))
+
+def job_argv(args):
+    # Job arguments are either an argv list or a dict: {"a": 7, "N": 15, "no_cache": true} -> -a 7 -N 15 --no-cache
+    # Names of one or two characters are short options (-a, -q1), longer ones long options
+    if isinstance(args, list):
+        return [str(arg) for arg in args]
+    argv = []
+    for name, value in args.items():
+        flag = f"-{name}" if len(name) <= 2 else f"--{name.replace('_', '-')}"
+        if value is True:
+            argv.append(flag)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            argv += [flag] + [str(item) for item in value]
+        else:
+            argv += [flag, str(value)]
+    return argv
+
+def run_job(number, job):
+    # Runs one job in this process and returns its JSON record. Headless-capable commands always run headless
+    # and their JSON goes in "result". Anything else printed is kept as text in "output"
+    command = job.get("command")
+    record = {"job": job.get("id", number), "command": command}
+    if command not in COMMANDS:
+        record.update(ok=False, error=f"Unknown command {command}")
+        return record
+    argv = job_argv(job.get("args", []))
+    if COMMANDS[command][2] and "--headless" not in argv:
+        argv.append("--headless")
+
+    captured = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(captured), contextlib.redirect_stderr(captured):
+            with instrumentation.span("batch.job", job=record["job"], command=command):
+                run_command(command, argv)
+        record["ok"] = True
+    except SystemExit as error:
+        # argparse errors and --help end in SystemExit
+        record.update(ok=error.code in (0, None), error=f"Exited with code {error.code}")
+    except Exception as error:
+        record.update(ok=False, error=f"{type(error).__name__}: {error}")
+    record["seconds"] = time.perf_counter() - start
+
+    output = captured.getvalue().strip()
+    try:
+        record["result"] = json.loads(output)
+    except ValueError:
+        if output:
+            record["output"] = output
+    return record
+
+def batch(path, output=None):
+    # One JSON job per line, e.g. {"command": "shor_order", "args": {"a": 7, "N": 15}}
+    # Every job runs in this process, so qiskit, Aer and the gate caches are loaded once for the whole file
+    stream = open_input(path)
+    out = sys.stdout if output in (None, "-") else open(output, "w")
+    try:
+        for number, line in enumerate(io.TextIOWrapper(stream, encoding="utf-8")):
+            if not line.strip():
+                continue
+            try:
+                record = run_job(number, json.loads(line))
+            except ValueError as error:
+                record = {"job": number, "ok": False, "error": f"Invalid job: {error}"}
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+            """
+            Single entry point for all the scripts in this package \n
+            Each subcommand takes the same arguments as its script (see pfcf <command> -h) and only imports what it needs \n
+            batch runs a JSON-lines file of jobs in one warm process and writes one JSON result per line
+            """),
+        epilog=textwrap.dedent(
+            """
+            Commands:
+            """) + "\n".join(f"{name:<16}{help_text}" for name, (_, help_text, _) in COMMANDS.items()) + textwrap.dedent(
+            """
+            batch           Run a JSON-lines file of jobs
+
+            Example usages:
+            python src/pfcf.py shor_order -a 7 -N 15 --headless
+            python src/pfcf.py rsa attack at dawn
+            python src/pfcf.py batch jobs.jsonl -o results.jsonl
+            python src/pfcf.py --trace trace.json qpe -n 4 --headless  (open trace.json in chrome://tracing)
+            where each line of jobs.jsonl looks like {"command": "qpe", "args": {"n": 3}}
+            """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Record phase spans to this file: Chrome trace if it ends in .json, JSON lines otherwise')
+    parser.add_argument('command', choices=list(COMMANDS) + ['batch'], metavar='command', help='Subcommand to run')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='Arguments of the subcommand')
+    return parser
+
+def run(args):
+    if args.trace is not None:
+        instrumentation.enable(args.trace)
+    if args.command != 'batch':
+        return run_command(args.command, args.arguments)
+
+    # batch has its own small parser
+    batch_parser = argparse.ArgumentParser(prog="pfcf batch")
+    batch_parser.add_argument('jobs', type=str, help='JSON-lines file of jobs. - reads stdin')
+    batch_parser.add_argument('-o', '--output', type=str, default=None, help='File for the results. Defaults to stdout')
+    batch_args = batch_parser.parse_args(args.arguments)
+    batch(batch_args.jobs, batch_args.output)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
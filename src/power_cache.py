@@ -0,0 +1,92 @@
+"""
+Cache of controlled-U^(2^i) gates shared by qpe.py and shor_order.py
+Powers are derived by repeated squaring, U^(2^(i+1)) = U^(2^i) x U^(2^i), and every controlled gate is
+synthesized once per process, keyed by operator hash and exponent
+Only the most recently used operators are kept, so long-lived processes (batches, sweep workers) stay bounded
+"""
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from qiskit.extensions import UnitaryGate
+
+from instrumentation import span
+
+
+def operator_key(U):
+    # Content hash of the matrix, so equal operators share entries whatever object holds them
+    U = np.ascontiguousarray(U)
+    digest = hashlib.sha1()
+    digest.update(str((U.shape, U.dtype.str)).encode())
+    digest.update(U.tobytes())
+    return digest.hexdigest()
+
+# Operators (or (oracle, a, N) keys) whose powers and gates are kept
+MAX_KEYS = int(os.environ.get("PFCF_POWER_CACHE_KEYS", 16))
+
+
+class ControlledPowerCache:
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> {"ladder": [U, U^2, U^4, ...], "gates": {i: controlled gate for U^(2^i)}}, least recently used first
+        self._entries = OrderedDict()
+
+    def _entry(self, key):
+        # Entry of key, marked as most recently used. Adding one past max_keys drops the least recently used
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {"ladder": None, "gates": dict()}
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(key)
+        return entry
+
+    def power(self, key, U, i):
+        # U^(2^i), squaring from the highest power already in the ladder
+        entry = self._entry(key)
+        if entry["ladder"] is None:
+            entry["ladder"] = [np.asarray(U)]
+        ladder = entry["ladder"]
+        while len(ladder) <= i:
+            with span("matrix_power", exponent=2 ** len(ladder), dimension=ladder[-1].shape[0]):
+                ladder.append(ladder[-1] @ ladder[-1])
+        return ladder[i]
+
+    def controlled_gate(self, key, i, build):
+        # build() is only called the first time (key, i) is requested
+        gates = self._entry(key)["gates"]
+        if i not in gates:
+            gates[i] = build()
+        return gates[i]
+
+    def has_gate(self, key, i):
+        return key in self._entries and i in self._entries[key]["gates"]
+
+    def release_powers(self, key):
+        # Drop the dense power matrices of key once its gates are built: they are only needed to build more gates
+        if key in self._entries:
+            self._entries[key]["ladder"] = None
+
+    def controlled_unitary_power(self, U, i, label=None, key=None):
+        # Controlled UnitaryGate for U^(2^i). Qubit 0 of the gate is the control
+        if key is None:
+            key = operator_key(U)
+
+        def build():
+            matrix = self.power(key, U, i)
+            with span("unitary_gate", exponent=2 ** i):
+                compound_u_gate = UnitaryGate(matrix)
+            if label is not None:
+                compound_u_gate.name = label
+            with span("unitary_control", exponent=2 ** i):
+                return compound_u_gate.control()
+
+        return self.controlled_gate(key, i, build)
+
+    def clear(self):
+        self._entries.clear()
+
+# Process-wide instance, so that repeated builds (sweeps, batches, worker processes) reuse synthesis
+default_cache = ControlledPowerCache()
@@ -0,0 +1,153 @@
+import argparse
+import secrets
+import textwrap
+import time
+
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def small_primes(limit=2 ** 16):
+    # Odd primes below limit, sieve of Eratosthenes
+    is_prime = np.ones(limit, dtype=bool)
+    is_prime[:2] = False
+    for i in range(2, int(limit ** 0.5) + 1):
+        if is_prime[i]:
+            is_prime[i * i::i] = False
+    return np.flatnonzero(is_prime)[1:].astype(np.int64)
+
+def residues(n, moduli):
+    # n mod m for every m at once, feeding n to NumPy in 31-bit limbs (Horner's rule)
+    limbs = []
+    while n:
+        limbs.append(n & 0x7FFFFFFF)
+        n >>= 31
+    remainder = np.zeros(moduli.size, dtype=np.int64)
+    for limb in reversed(limbs):
+        remainder = ((remainder << 31) + limb) % moduli
+    return remainder
+
+def sieve_window(start, window, primes):
+    # Marks which of the odd candidates start, start + 2, ..., start + 2(window - 1) have no factor in primes
+    # start + 2i = 0 (mod p) when i = -start / 2 (mod p), and 1/2 = (p + 1) / 2 (mod p)
+    survivors = np.ones(window, dtype=bool)
+    first = (-residues(start, primes) * ((primes + 1) // 2)) % primes
+    for p, i in zip(primes.tolist(), first.tolist()):
+        survivors[i::p] = False
+    return np.flatnonzero(survivors)
+
+def default_rounds(bits):
+    # Miller-Rabin rounds for a false-positive probability below 2^-100 on random candidates (FIPS 186-4, C.3)
+    if bits <= 512:
+        return 7
+    if bits <= 1024:
+        return 5
+    if bits <= 1536:
+        return 4
+    return 3
+
+def strong_probable_prime(n, base):
+    # One Miller-Rabin round: n - 1 = d 2^s, then base^d = 1 or base^(d 2^j) = -1 for some j < s
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    x = pow(base, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+def miller_rabin(n, rounds):
+    for _ in range(rounds):
+        if not strong_probable_prime(n, 2 + secrets.randbelow(n - 3)):
+            return False
+    return True
+
+def random_prime(bits, rounds=None, window=None, sieve_limit=2 ** 16, stats=None):
+    # Incremental search: sieve a window of odd candidates after a random start, then test the survivors
+    # The two top bits are set, so the product of two such primes has exactly 2 * bits bits
+    if bits < 32:
+        raise ValueError("bits must be at least 32")
+    rounds = rounds or default_rounds(bits)
+    window = window or 8 * bits
+    primes = small_primes(sieve_limit)
+
+    while True:
+        start = secrets.randbits(bits) | (3 << (bits - 2)) | 1
+        while start + 2 * window < (1 << bits):
+            survivors = sieve_window(start, window, primes)
+            # Batched testing: a single base-2 round discards almost every composite survivor,
+            # and only the candidates passing it pay for the full set of random-base rounds
+            for i in survivors.tolist():
+                candidate = start + 2 * i
+                if stats is not None:
+                    stats["exponentiations"] = stats.get("exponentiations", 0) + 1
+                if not strong_probable_prime(candidate, 2):
+                    continue
+                if stats is not None:
+                    stats["exponentiations"] += rounds
+                if miller_rabin(candidate, rounds):
+                    return candidate
+            start += 2 * window
+
+def benchmark(sizes=(512, 1024, 2048, 3072), count=5):
+    # Mean time per prime of random_prime against pycryptodome's getPrime
+    from Crypto.Util import number
+
+    print(f"Mean time per prime over {count} primes")
+    print(f"{'bits':>6} | {'random_prime':>12} | {'getPrime':>10} | speedup | exponentiations per prime")
+    results = dict()
+    for bits in sizes:
+        stats = dict()
+        start = time.perf_counter()
+        for _ in range(count):
+            random_prime(bits, stats=stats)
+        native = (time.perf_counter() - start) / count
+
+        start = time.perf_counter()
+        for _ in range(count):
+            number.getPrime(bits)
+        reference = (time.perf_counter() - start) / count
+
+        results[bits] = {"random_prime": native, "getPrime": reference}
+        print(f"{bits:>6} | {native:>10.3f} s | {reference:>8.3f} s | {reference / native:>6.2f}x | "
+              f"{stats['exponentiations'] / count:.1f}")
+    return results
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+        """
+        Generates random primes: a window of odd candidates is sieved against small primes with NumPy \n
+        and only the survivors go through Miller-Rabin \n
+        """),
+        epilog=textwrap.dedent(
+        """
+        Example usages:
+        python src/primes.py --bits 1024
+        python src/primes.py --benchmark
+        """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--bits', type=int, default=1024, help='Size of the prime. Defaults to 1024')
+    parser.add_argument('--rounds', type=int, default=None, help='Miller-Rabin rounds. Defaults to a size-based table')
+    parser.add_argument('--benchmark', action='store_true', help='Compare against Crypto.Util.number.getPrime')
+    parser.add_argument('--count', type=int, default=5, help='Primes per size in the benchmark. Defaults to 5')
+    return parser
+
+def run(args):
+    if args.benchmark:
+        benchmark(count=args.count)
+    else:
+        print(random_prime(args.bits, args.rounds))
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -1,19 +1,28 @@
 import argparse
+import json
 import textwrap
 
 from qiskit import QuantumCircuit, QuantumRegister
 
-from qiskit.tools.visualization import plot_bloch_multivector
 from qiskit.quantum_info import Statevector
 
 from qiskit.circuit.library import QFT
 
-import matplotlib.pyplot as plt
+from instrumentation import span
 
 import math
 
 
-def main(state, qubits):
+def amplitudes(statevector):
+    # JSON-friendly [real, imaginary] pairs
+    return [[z.real, z.imag] for z in statevector.data.tolist()]
+
+def main(state, qubits, headless=False):
+    # Headless: no drawing or Bloch spheres, states before and after the QFT printed as JSON
+    if not headless:
+        import matplotlib.pyplot as plt
+        from qiskit.tools.visualization import plot_bloch_multivector
+
     # Build the circuit
     q_register = []
     for i in range(qubits):
@@ -30,24 +39,36 @@ def main(state, qubits):
         i -= 1
 
     # Show the state before qft in Bloch sphere
-    plot_state = Statevector(qc)
-    plot_bloch_multivector(plot_state, title=f"State |{state}> on {qubits} qubits", reverse_bits=True)
+    with span("statevector", stage="before"):
+        plot_state = Statevector(qc)
+    before = plot_state
+    if not headless:
+        with span("plot_bloch", stage="before"):
+            plot_bloch_multivector(plot_state, title=f"State |{state}> on {qubits} qubits", reverse_bits=True)
 
     # Add qft
     qfc = QFT(num_qubits=qubits, name='QFT')
     qc.append(qfc, list(range(qubits)))
 
     # Show the state after qft in Bloch sphere
-    plot_state = Statevector(qc)
-    plot_bloch_multivector(plot_state, title=f"State QFT|{state}> on {qubits} qubits", reverse_bits=True)
+    with span("statevector", stage="after") as state_span:
+        plot_state = Statevector(qc)
+        state_span.circuit(qc)
+    if headless:
+        print(json.dumps({"j": state, "qubits": qubits, "before": amplitudes(before), "after": amplitudes(plot_state)}))
+        return
+    with span("plot_bloch", stage="after"):
+        plot_bloch_multivector(plot_state, title=f"State QFT|{state}> on {qubits} qubits", reverse_bits=True)
 
     # Draw circuit
-    qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
+    with span("draw"):
+        qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
     plt.show()
 
-if __name__ == "__main__":
+def build_parser(prog=None):
     # Script instruction
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=textwrap.dedent(
             """
             This script performs quantum Fourier transform QFT|j> for some state |j> in the computational basis of the system \n
@@ -62,8 +83,10 @@ if __name__ == "__main__":
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-n', nargs=1, type=int, help='Number of qubits. Defaults to minimum needed')
     parser.add_argument('j', nargs=1, type=int, help='Element |j> of the computational basis')
-    args = parser.parse_args()
+    parser.add_argument('--headless', action='store_true', help='Batch mode: no drawing or plots, states printed as JSON')
+    return parser
 
+def run(args):
     n = args.n
     j = abs(args.j[0]) # Take module for safety
 
@@ -81,6 +104,9 @@ if __name__ == "__main__":
 
     # Check for the case when user passes a number of qubits
     if pow(2, n) > j:
-        main(j, n)
+        main(j, n, args.headless)
     else:
         print(f"Invalid number of qubits {n} for state desired {j}")
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
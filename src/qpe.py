@@ -1,20 +1,26 @@
 import argparse
+import json
 import textwrap
+import time
 
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister, Aer, transpile
 
-from qiskit.tools.visualization import plot_histogram
 from qiskit.quantum_info import Statevector
-from qiskit.extensions import Initialize, UnitaryGate
+from qiskit.extensions import Initialize
 from qiskit.circuit.library import QFT
 
 import numpy as np
-import matplotlib.pyplot as plt
 
-import math
+from power_cache import default_cache, operator_key
+from circuit_cache import cached_transpile
+import backend_selection
+from backend_selection import prepare
+from instrumentation import span
+from statevector_sampling import (exact_probabilities, nonzero_probabilities, sample_counts, bitstring_counts,
+                                  total_variation_distance)
 
 
-def main(eval_qubits):
+def get_operator():
     #########################################################################
     ################ CHANGE HERE FOR DIFFERENT U AND |phi> ##################
     #########################################################################
@@ -24,17 +30,11 @@ def main(eval_qubits):
     U = np.array([[0, 1], [-1, 0]])
     phi = (1/np.sqrt(2))*np.array([1, 1j])
     #########################################################################
+    return U, phi
 
-    # Acknowledge user input
-    print(f"Operator U:")
-    print(f"{U}")
-    print(f"Eigenstate |phi>:")
-    print(f"{phi}")
-
+def build_circuit(U, phi, eval_qubits):
     # Qubits in eigenstate register
     eigen_qubits = int(np.log2(phi.size))
-    print(f"Number of eigenstate qubits needed   : {eigen_qubits}")
-    print(f"Number of evaluation qubits requested: {eval_qubits}")
 
     # Build circuit structure
     eigen_register = []
@@ -54,14 +54,11 @@ def main(eval_qubits):
     for i in range(eval_qubits):
         qc.h(i + eigen_qubits)
 
-    # Add rotation gates
+    # Add rotation gates. Powers come from the squaring ladder and gates are synthesized once per process
     for i in range(eval_qubits):
-        power = pow(2, i)
-        compound_u = np.linalg.matrix_power(U, power)
-        compound_u_gate = UnitaryGate(compound_u)
-        compound_u_gate.name = f"$CU^{2**i}$"
-        controlled_u_gate = compound_u_gate.control()
+        controlled_u_gate = default_cache.controlled_unitary_power(U, i, label=f"$CU^{2**i}$")
         qc.append(controlled_u_gate, [i+eigen_qubits, *list(range(eigen_qubits))])
+    default_cache.release_powers(operator_key(U))
 
     # Inverse qft
     qft = QFT(num_qubits=eval_qubits)
@@ -72,23 +69,252 @@ def main(eval_qubits):
     for i in range(eval_qubits):
         qc.measure(i+eigen_qubits, i)
 
-    # Draw circuit
-    qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
+    return qc
+
+def eigenphase(U, phi, tolerance=1e-9):
+    # Phase theta in [0, 1) such that U|phi> = e^(2 pi i theta)|phi>
+    phi = phi / np.linalg.norm(phi)
+    u_phi = U @ phi
+    eigenvalue = np.vdot(phi, u_phi)
+    if np.linalg.norm(u_phi - eigenvalue * phi) > tolerance:
+        raise ValueError("|phi> is not an eigenvector of U")
+    return (np.angle(eigenvalue) / (2 * np.pi)) % 1
+
+def eigenphase_or_none(U, phi):
+    # Same as eigenphase, but None for a |phi> that is not an eigenvector (rounded, or a superposition of eigenvectors)
+    try:
+        return eigenphase(U, phi)
+    except ValueError:
+        return None
+
+def analytic_distribution(theta, eval_qubits):
+    # Exact QPE outcome probabilities (Fejer kernel):
+    # P(y) = sin^2(pi M d) / (M^2 sin^2(pi d)) with M = 2^eval_qubits and d = theta - y/M
+    M = 2 ** eval_qubits
+    delta = theta - np.arange(M) / M
+    denominator = np.sin(np.pi * delta)
+    exact = np.abs(denominator) < 1e-12
+    denominator[exact] = 1
+    probabilities = np.sin(np.pi * M * delta) ** 2 / (M ** 2 * denominator ** 2)
+    # When theta is exactly y/M the whole probability sits on y
+    probabilities[exact] = 1
+    return probabilities
+
+def build_round_circuit(U, phi, power, correction=0.0):
+    # One round of iterative QPE: a single ancilla (last qubit) picks up the phase of U^(2^power) on |phi>,
+    # minus correction (in turns), and is measured after a final Hadamard
+    eigen_qubits = int(np.log2(phi.size))
+
+    eigen_register = []
+    for i in range(eigen_qubits):
+        eigen_register.append(QuantumRegister(1, f"eigen{i}"))
+    qc = QuantumCircuit(*eigen_register, QuantumRegister(1, "ancilla"), ClassicalRegister(1))
+    ancilla = eigen_qubits
+
+    init_gate = Initialize(Statevector(phi))
+    init_gate.name = "$|\phi>$"
+    qc.append(init_gate, list(range(eigen_qubits)))
+
+    qc.h(ancilla)
+    controlled_u_gate = default_cache.controlled_unitary_power(U, power, label=f"$CU^{2**power}$")
+    qc.append(controlled_u_gate, [ancilla, *list(range(eigen_qubits))])
+    if correction:
+        qc.p(-2 * np.pi * correction, ancilla)
+    qc.h(ancilla)
+    qc.measure(ancilla, 0)
+    return qc
+
+def run_round(U, phi, power, correction, shots, simulator, seed=None):
+    # Number of shots that measured 1, and the wall time of the round (build, transpile and run)
+    start = time.perf_counter()
+    with span("iterative_round", exponent=2 ** power, correction=correction) as round_span:
+        qc = build_round_circuit(U, phi, power, correction)
+        circuit, decision = prepare(transpile(qc, simulator))
+        result = simulator.run(circuit, shots=shots, seed_simulator=seed, **decision["options"]).result()
+        round_span.aer_result(result)
+    return result.get_counts().get("1", 0), time.perf_counter() - start
+
+def iterative_phase_estimation(U, phi, max_bits, shots=1024, seed=None, simulator=None, confirm_shots=None):
+    # Estimates theta = 0.b_1 b_2 ... b_m (binary) with one ancilla, one round per circuit
+    # 1. The round with U^(2^j) and no correction always measures 0 exactly when 2^j theta is an integer, which then
+    #    holds for every larger j. A binary search over 0 <= j <= max_bits finds the number of bits m of theta in
+    #    about log2(max_bits) rounds, or settles on m = max_bits when theta has no exact max_bits-bit expansion
+    #    No 1 in shots only bounds P(1), so such a round is run again with confirm_shots (16 x shots by default)
+    #    before it counts. "exact" is then a hypothesis with P(1) < 3 / confirm_shots at 95% confidence
+    # 2. Bits are measured least significant first: U^(2^(i-1)) kicks back 0.b_i b_i+1 ... b_m, and removing the
+    #    bits already known leaves 0.b_i, read out by majority vote
+    simulator = simulator or Aer.get_backend('aer_simulator')
+    confirm_shots = confirm_shots or 16 * shots
+    rounds = []
+    probes = dict()
+    confirmed = dict()
+
+    def probe(j):
+        if j not in probes:
+            ones, seconds = run_round(U, phi, j, 0.0, shots, simulator, seed)
+            rounds.append({"kind": "probe", "exponent": 2 ** j, "correction": 0.0, "shots": shots, "ones": ones,
+                           "seconds": seconds})
+            probes[j] = ones
+        return probes[j]
 
-    # Compile and run
-    simulator = Aer.get_backend('aer_simulator')
-    transpiled = transpile(qc, simulator)
+    def vanishes(j):
+        # A small but nonzero P(1) often gives no 1 in shots by chance, so a zero is confirmed with more shots
+        if probe(j) != 0:
+            return False
+        if j not in confirmed:
+            ones, seconds = run_round(U, phi, j, 0.0, confirm_shots, simulator, None if seed is None else seed + 1)
+            rounds.append({"kind": "confirm", "exponent": 2 ** j, "correction": 0.0, "shots": confirm_shots,
+                           "ones": ones, "seconds": seconds})
+            confirmed[j] = ones == 0
+        return confirmed[j]
 
-    result = simulator.run(transpiled).result()
-    data = result.get_counts()
-    plot_histogram(data, title=f"QPE $(U, |\phi>)$ on {eval_qubits} eval qubits")
+    exact = vanishes(max_bits)
+    precision = max_bits
+    if exact:
+        low, high = 0, max_bits
+        while low < high:
+            middle = (low + high) // 2
+            if vanishes(middle):
+                high = middle
+            else:
+                low = middle + 1
+        precision = low
+
+    bits = dict()
+    for i in range(precision, 0, -1):
+        correction = sum(bits[l] / 2 ** (l - i + 1) for l in range(i + 1, precision + 1))
+        if correction == 0 and i - 1 in probes:
+            # Same circuit as an earlier probe
+            ones = probes[i - 1]
+        else:
+            ones, seconds = run_round(U, phi, i - 1, correction, shots, simulator, seed)
+            rounds.append({"kind": "bit", "exponent": 2 ** (i - 1), "correction": correction, "shots": shots,
+                           "ones": ones, "seconds": seconds})
+        bits[i] = int(ones > shots / 2)
+
+    default_cache.release_powers(operator_key(U))
+    theta = sum(bits[i] / 2 ** i for i in bits)
+    binary = "0." + "".join(str(bits[i]) for i in range(1, precision + 1)) if precision else "0"
+    return {"theta": theta, "binary": binary, "precision": precision, "exact": exact,
+            "p_one_bound": 3 / confirm_shots if exact else None, "rounds": rounds}
+
+def main(eval_qubits, analytic=False, shots=1024, seed=None, use_cache=True, headless=False, statevector=False,
+         iterative=False):
+    # Headless: nothing is drawn or plotted and the only output is one JSON object on stdout
+    U, phi = get_operator()
+
+    # Qubits in eigenstate register
+    eigen_qubits = int(np.log2(phi.size))
+    output = {"eigen_qubits": eigen_qubits, "eval_qubits": eval_qubits, "analytic": analytic,
+              "statevector": statevector, "iterative": iterative, "shots": shots}
+
+    # Acknowledge user input
+    if not headless:
+        print(f"Operator U:")
+        print(f"{U}")
+        print(f"Eigenstate |phi>:")
+        print(f"{phi}")
+        print(f"Number of eigenstate qubits needed   : {eigen_qubits}")
+        if iterative:
+            print(f"Maximum number of phase bits requested: {eval_qubits}")
+        else:
+            print(f"Number of evaluation qubits requested: {eval_qubits}")
+
+    if iterative:
+        # A single ancilla over repeated rounds instead of eval_qubits qubits and an inverse QFT. No histogram to plot
+        estimate = iterative_phase_estimation(U, phi, eval_qubits, shots, seed)
+        output.update(estimate)
+        # The reference phase only exists when |phi> is an eigenvector of U
+        reference = eigenphase_or_none(U, phi)
+        if reference is not None:
+            difference = abs(estimate["theta"] - reference)
+            output["eigenphase"] = reference
+            output["phase_error"] = min(difference, 1 - difference)
+        if headless:
+            print(json.dumps(output))
+            return output
+        for number, entry in enumerate(estimate["rounds"]):
+            print(f"Round {number}: {entry['kind']:<7} U^{entry['exponent']:<6} correction {entry['correction']:.6f} "
+                  f"measured 1 in {entry['ones']}/{entry['shots']} shots ({entry['seconds']:.3f} s)")
+        if estimate["exact"]:
+            status = f"exact, assuming P(1) = 0 where no 1 was seen: P(1) < {estimate['p_one_bound']:.1e} at 95% confidence"
+        else:
+            status = "truncated"
+        print(f"Estimated phase: {estimate['theta']} ({estimate['binary']}, {estimate['precision']} bits, {status})")
+        if reference is not None:
+            print(f"Eigenphase theta: {reference}")
+        return output
+
+    if analytic:
+        # No circuit: the distribution follows from the eigenphase alone, so |phi> has to be an eigenvector
+        try:
+            theta = eigenphase(U, phi)
+        except ValueError as error:
+            output["error"] = str(error)
+            print(json.dumps(output) if headless else f"Analytic mode needs an eigenvector: {error}")
+            return output
+        output["theta"] = theta
+        if not headless:
+            print(f"Eigenphase theta: {theta}")
+        with span("analytic_sampling", eval_qubits=eval_qubits, shots=shots):
+            data = bitstring_counts(sample_counts(analytic_distribution(theta, eval_qubits), shots, seed), eval_qubits)
+    else:
+        # Compile, or load the transpiled circuit for this U, |phi> and register size from the cache
+        simulator = Aer.get_backend('aer_simulator')
+        params = {"U": operator_key(U), "phi": operator_key(phi), "eval_qubits": eval_qubits}
+        transpiled, qc = cached_transpile("qpe", params, lambda: build_circuit(U, phi, eval_qubits), simulator, use_cache)
+        output["cached"] = qc is None
+
+        # Draw circuit
+        if not headless:
+            if qc is not None:
+                with span("draw"):
+                    qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
+            else:
+                print("Transpiled circuit loaded from cache")
+
+        if statevector:
+            # One simulation without measurements, then any number of shots drawn from the exact distribution
+            probabilities = exact_probabilities(transpiled, simulator)
+            output["probabilities"] = {format(y, f"0{eval_qubits}b"): p
+                                       for y, p in nonzero_probabilities(probabilities).items()}
+            with span("sampling", shots=shots):
+                data = bitstring_counts(sample_counts(probabilities, shots, seed), eval_qubits)
+        else:
+            circuit, decision = prepare(transpiled)
+            with span("aer_run", shots=shots, method=decision["method"]) as run_span:
+                result = simulator.run(circuit, shots=shots, **decision["options"]).result()
+                run_span.aer_result(result)
+            data = result.get_counts()
+
+        # Compare the simulated histogram against the exact reference, when |phi> is an eigenvector and there is one
+        theta = eigenphase_or_none(U, phi)
+        if theta is not None:
+            distance = total_variation_distance(data, analytic_distribution(theta, eval_qubits))
+            output["total_variation_distance"] = float(distance)
+            if not headless:
+                print(f"Total variation distance to the analytic distribution: {distance:.4f}")
+    output["counts"] = dict(data)
+
+    if headless:
+        print(json.dumps(output))
+        return output
+
+    # Plotting modules are only loaded when something is going to be shown
+    import matplotlib.pyplot as plt
+    from qiskit.tools.visualization import plot_histogram
+
+    with span("plot"):
+        plot_histogram(data, title=f"QPE $(U, |\phi>)$ on {eval_qubits} eval qubits")
 
     # Show all images
     plt.show()
+    return output
 
-if __name__ == "__main__":
+def build_parser(prog=None):
     # Script instruction
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=textwrap.dedent(
             """
             This script performs quantum phase estimation for some unitary operator U and eigenstate |phi> \n
@@ -99,11 +325,40 @@ if __name__ == "__main__":
             """
             Example usages: 
             python src/qpe.py -n 2
+            python src/qpe.py -n 12 --analytic
+            python src/qpe.py -n 8 --statevector -s 1000000
+            python src/qpe.py -n 16 --iterative
+            python src/qpe.py -n 4 --headless > result.json
             """),
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-n', nargs=1, type=int, help='Number of qubits in evaluation register', required=True)
-    args = parser.parse_args()
+    parser.add_argument('--analytic', action='store_true',
+                        help='Sample the exact outcome distribution computed from the eigenphase instead of simulating')
+    parser.add_argument('--statevector', action='store_true',
+                        help='Simulate once without measurements and sample the exact evaluation register distribution')
+    parser.add_argument('--iterative', action='store_true',
+                        help=textwrap.dedent(
+                            """
+                            Iterative QPE: one ancilla, one circuit per round, earlier bits fed back as phase corrections
+                            -n is then the maximum number of bits, and rounds stop early when the phase is exact
+                            """))
+    parser.add_argument('-s', '--shots', type=int, default=1024, help='Number of shots. Defaults to 1024')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the analytic and statevector sampling and the iterative rounds')
+    parser.add_argument('--no-cache', action='store_true', help='Always build and transpile, skipping the on-disk circuit cache')
+    parser.add_argument('--headless', action='store_true', help='Batch mode: no drawing or plots, results printed as JSON')
+    backend_selection.add_arguments(parser)
+    return parser
 
+def run(args):
     n = abs(args.n[0])
-    main(n)
+    backend_selection.configure_from(args, verbose=not args.headless)
+    try:
+        with span("qpe.main", eval_qubits=n, analytic=args.analytic, statevector=args.statevector,
+                  iterative=args.iterative):
+            main(n, args.analytic, args.shots, args.seed, not args.no_cache, args.headless, args.statevector,
+                 args.iterative)
+    except MemoryError as error:
+        print(json.dumps({"error": str(error)}) if args.headless else error)
 
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -1,23 +1,19 @@
 import argparse
 import re
-from Crypto.Util import number
 import math
 import textwrap
+import timeit
 
+import primes
+from instrumentation import span
+from number_theory import mod_inverse
 
-def gcdExtended(a, b):
-    # Base Case
-    if a == 0:
-        return b, 0, 1
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-    r, s1, t1 = gcdExtended(b % a, a)
+# Everything Alice keeps to herself. dp, dq and qinv are precomputed for CRT decryption
+RSAPrivateKey = namedtuple("RSAPrivateKey", ["N", "a", "b", "p", "q", "dp", "dq", "qinv"])
 
-    # Update x and y using results of recursive
-    # call
-    s = t1 - (b // a) * s1
-    t = s1
-
-    return r, s, t
 
 def encode_text_to_int(text):
     # Default encoding is UTF-8
@@ -29,14 +25,89 @@ def decode_int_to_text(decimal_number):
     # Default encoding is UTF-8
     return decimal_number.to_bytes(byte_length, byteorder='big').decode()
 
-def main(plaintext):
+def generate_primes(bits=1024, count=2, workers=None):
+    # Each prime is searched for in its own process, so p and q are found at the same time
+    with ProcessPoolExecutor(max_workers=workers or count) as executor:
+        return list(executor.map(primes.random_prime, [bits] * count))
+
+def generate_private_key(p, q, a, b):
+    # CRT components: exponents reduced mod p-1 and q-1, and q^-1 mod p for recombination
+    dp = b % (p - 1)
+    dq = b % (q - 1)
+    return RSAPrivateKey(p * q, a, b, p, q, dp, dq, mod_inverse(q, p))
+
+def usable_primes(p, q, a):
+    # a has to be invertible mod phi(N), which fails whenever a divides p-1 or q-1
+    return p != q and math.gcd(a, (p - 1) * (q - 1)) == 1
+
+def generate_key(bits=1024, a=65537, workers=None):
+    # p and q come from parallel searches. Retry in the (rare) case they cannot be used with a
+    while True:
+        p, q = generate_primes(bits, 2, workers)
+        if usable_primes(p, q, a):
+            return generate_private_key(p, q, a, mod_inverse(a, (p - 1) * (q - 1)))
+
+def decrypt_plain(y, key):
+    # Single exponentiation on the full modulus
+    return pow(y, key.b, key.N)
+
+def decrypt_crt(y, key, parallel=False):
+    # x = y^b mod N from two half-size exponentiations mod p and mod q (Garner's recombination)
+    if parallel:
+        # Big-integer pow may hold the GIL, so the gain depends on the interpreter
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_p = executor.submit(pow, y % key.p, key.dp, key.p)
+            future_q = executor.submit(pow, y % key.q, key.dq, key.q)
+            x_p, x_q = future_p.result(), future_q.result()
+    else:
+        x_p = pow(y % key.p, key.dp, key.p)
+        x_q = pow(y % key.q, key.dq, key.q)
+    h = (key.qinv * (x_p - x_q)) % key.p
+    return x_q + h * key.q
+
+def decrypt(y, key, parallel=False):
+    # CRT decryption, checked by re-encrypting. A faulty CRT result falls back to the full exponentiation
+    x = decrypt_crt(y, key, parallel)
+    if pow(x, key.a, key.N) != y:
+        x = decrypt_plain(y, key)
+    return x
+
+def benchmark(bits=1024, repeat=50):
+    # Compare full-modulus and CRT decryption on one freshly generated key
+    key = generate_key(bits)
+    y = pow(123456789, key.a, key.N)
+
+    timings = {
+        "full modulus": timeit.timeit(lambda: decrypt_plain(y, key), number=repeat) / repeat,
+        "CRT": timeit.timeit(lambda: decrypt_crt(y, key), number=repeat) / repeat,
+        "CRT, 2 threads": timeit.timeit(lambda: decrypt_crt(y, key, parallel=True), number=repeat) / repeat,
+        "CRT, checked": timeit.timeit(lambda: decrypt(y, key), number=repeat) / repeat,
+    }
+    print(f"Decryption with {2 * bits}-bit modulus, mean of {repeat} runs:")
+    for name, seconds in timings.items():
+        print(f"{name:<15}: {seconds * 1e3:8.3f} ms ({timings['full modulus'] / seconds:.2f}x)")
+    return timings
+
+def main(plaintext, pool=None, max_uses=1):
 
     # KEY GENERATION
     print("KEY GENERATION PHASE")
     # 1)
-    # Using RSA with 1024 bit primes
-    p = number.getPrime(1024)
-    q = number.getPrime(1024)
+    # Using RSA with 1024 bit primes, taken from a pre-generated pool when one is given
+    pooled = None
+    if pool is not None:
+        import rsa_keypool
+        pooled = rsa_keypool.KeyPool(pool).take(max_uses)
+        if pooled is None:
+            print(f"Key pool {pool} is empty, generating a fresh key")
+    if pooled is not None:
+        p, q = pooled.p, pooled.q
+    else:
+        # Primes are drawn again until 65537 is invertible mod phi(N), so the steps below cannot fail
+        with span("rsa.keygen_primes", bits=1024):
+            p, q = generate_primes(1024)
+            while not usable_primes(p, q, 65537):
+                p, q = generate_primes(1024)
     N = p*q
     print(f"""
         1) Alice generates a pair of two large integers p and q:
@@ -60,7 +131,8 @@ def main(plaintext):
         gcd(a, phi(N)) = {math.gcd(a, phi)}
         """)
     # 4)
-    _, b, _ = gcdExtended(a, phi)
+    with span("rsa.keygen_inverse"):
+        b = mod_inverse(a, phi)
     print(f"""
         4) Alice calculates b such that a x b congruent 1 (mod phi(N)):
         b                  = {b}
@@ -68,8 +140,14 @@ def main(plaintext):
         """)
 
     # 5)
+    with span("rsa.keygen_crt"):
+        key = generate_private_key(p, q, a, b)
     print(f"""
         5) Alice sends values (N, a) over the network and saves (p, q, b) for herself
+        For faster decryption she also keeps dp = b mod (p-1), dq = b mod (q-1) and qinv = q^-1 mod p:
+        dp   = {key.dp}
+        dq   = {key.dq}
+        qinv = {key.qinv}
         """)
 
     # MESSAGE EXCHANGE
@@ -87,9 +165,12 @@ def main(plaintext):
         Encoded plaintext x = {int_plaintext}
         In Z_N?             = {int_plaintext < N}
         """)
+    if int_plaintext >= N:
+        print("Message does not fit in Z_N and will not decrypt correctly. Use src/rsa_stream.py for long messages")
 
     # 8)
-    int_ciphertext = pow(int_plaintext, a, N)
+    with span("rsa.encrypt"):
+        int_ciphertext = pow(int_plaintext, a, N)
     print(f"""
         8) Bob calculates ciphertext y in Z_N by taking y = x^a:
         Encoded ciphertext y = {int_ciphertext}
@@ -101,9 +182,10 @@ def main(plaintext):
         """)
 
     # 10)
-    int_plaintext_line = pow(int_ciphertext, b, N)
+    with span("rsa.decrypt"):
+        int_plaintext_line = decrypt(int_ciphertext, key)
     print(f"""
-        10) Alice receives y and calculates x' = y^b:
+        10) Alice receives y and calculates x' = y^b, using CRT: x' = y^dp mod p and y^dq mod q, recombined with qinv:
         Encoded plaintext x' = {int_plaintext_line}
         """)
 
@@ -115,14 +197,10 @@ def main(plaintext):
         Equal to Bob's  = {plaintext_line == plaintext}
         """)
 
-
-
-
-
-
-if __name__ == "__main__":
+def build_parser(prog=None):
     # Script instruction
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=textwrap.dedent(
         """
         This script implements the RSA cryptosystem in order to exemplify its operation \n
@@ -131,11 +209,19 @@ if __name__ == "__main__":
         """),
         epilog=textwrap.dedent(
         """
-        Example usage: python src/rsa.py attack at dawn
+        Example usages:
+        python src/rsa.py attack at dawn
+        python src/rsa.py --benchmark
+        python src/rsa.py --pool keys/ --max-uses 3 attack at dawn  (fill it first with src/rsa_keypool.py)
         """),
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('message', nargs='*', default='', type=str, help='The message to be transmitted. Only a-zA-Z0-9 characters allowed')
-    args = parser.parse_args()
+    parser.add_argument('--benchmark', action='store_true', help='Compare full-modulus and CRT decryption times')
+    parser.add_argument('--pool', type=str, default=None, help='Directory of a pre-generated key pool to take the key from')
+    parser.add_argument('--max-uses', type=int, default=1, help='Times a pooled key may be used before it is discarded')
+    return parser
+
+def run(args):
     message = args.message
 
     # Remove non-alphanum and join with spaces for the code
@@ -144,5 +230,10 @@ if __name__ == "__main__":
     filtered = list(filter(lambda a: a != '', filtered))
     message_sent = str.join(" ",filtered)
     # Call the RSA
-    main(message_sent)
+    if args.benchmark:
+        benchmark()
+    else:
+        main(message_sent, args.pool, args.max_uses)
 
+if __name__ == "__main__":
+    run(build_parser().parse_args())
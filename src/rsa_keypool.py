@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import textwrap
+import threading
+import time
+import uuid
+
+import rsa
+
+
+class KeyPool:
+    # One JSON file per key. Taking a key renames its file first, which is atomic,
+    # so concurrent processes never get the same use of a key
+    def __init__(self, directory, bits=1024):
+        self.directory = directory
+        self.bits = bits
+        os.makedirs(directory, exist_ok=True)
+
+    def _keys(self):
+        return (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json"))
+
+    def size(self):
+        return sum(1 for _ in self._keys())
+
+    def put(self, key, uses=0, name=None):
+        name = name or f"{uuid.uuid4().hex}.json"
+        temporary = os.path.join(self.directory, f".{name}.tmp")
+        with open(temporary, "w") as f:
+            json.dump({"key": key._asdict(), "uses": uses}, f)
+        os.replace(temporary, os.path.join(self.directory, name))
+
+    def take(self, max_uses=1):
+        # O(1): the first key file found is claimed, no index of the pool is built
+        for entry in self._keys():
+            claimed = f"{entry.path}.{os.getpid()}.claimed"
+            try:
+                os.rename(entry.path, claimed)
+            except FileNotFoundError:
+                continue  # Claimed by someone else in the meantime
+            with open(claimed) as f:
+                record = json.load(f)
+            os.remove(claimed)
+
+            # Keys that may still be reused go back into the pool
+            uses = record["uses"] + 1
+            if uses < max_uses:
+                self.put(rsa.RSAPrivateKey(**record["key"]), uses, entry.name)
+            return rsa.RSAPrivateKey(**record["key"])
+        return None
+
+    def fill(self, depth, workers=None):
+        # Top the pool up to depth keys
+        added = 0
+        while self.size() < depth:
+            self.put(rsa.generate_key(self.bits, workers=workers))
+            added += 1
+        return added
+
+    def start_filler(self, depth, interval=1.0, workers=None):
+        # Background thread that keeps the pool topped up. Stop it by setting the returned event
+        stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                if self.size() < depth:
+                    self.put(rsa.generate_key(self.bits, workers=workers))
+                else:
+                    stop.wait(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+        return stop
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+        """
+        Fills a directory with pre-generated RSA keys for src/rsa.py --pool \n
+        Primes p and q of each key are generated in parallel processes \n
+        ** THIS IS NOT A SECURE WAY TO STORE PRIVATE KEYS ** \n
+        """),
+        epilog=textwrap.dedent(
+        """
+        Example usages:
+        python src/rsa_keypool.py keys/ --depth 8
+        python src/rsa_keypool.py keys/ --depth 8 --watch
+        """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('directory', type=str, help='Pool directory')
+    parser.add_argument('--depth', type=int, default=8, help='Number of keys to keep in the pool. Defaults to 8')
+    parser.add_argument('--bits', type=int, default=1024, help='Size of each prime. Defaults to 1024')
+    parser.add_argument('--watch', action='store_true', help='Keep running and top the pool up as keys are taken')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between checks with --watch')
+    return parser
+
+def run(args):
+    pool = KeyPool(args.directory, args.bits)
+    if args.watch:
+        stop = pool.start_filler(args.depth, args.interval)
+        print(f"Keeping {args.directory} at {args.depth} keys. Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            stop.set()
+    else:
+        start = time.perf_counter()
+        added = pool.fill(args.depth)
+        print(f"Added {added} keys to {args.directory} in {time.perf_counter() - start:.2f} s (pool size {pool.size()})")
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
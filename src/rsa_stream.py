@@ -0,0 +1,77 @@
+import secrets
+import textwrap
+
+import rsa
+import streaming
+from streaming import BlockCipher, worker_key
+
+
+def modulus_width(N):
+    return (N.bit_length() + 7) // 8
+
+def payload_size(N):
+    # PKCS#1 v1.5 encryption padding takes 11 bytes of every block
+    return modulus_width(N) - 11
+
+def pad(chunk, width):
+    # 0x00 0x02 | at least 8 nonzero random bytes | 0x00 | data
+    padding = bytearray()
+    while len(padding) < width - 3 - len(chunk):
+        padding += bytes(byte for byte in secrets.token_bytes(width - 3 - len(chunk) - len(padding)) if byte != 0)
+    return b"\x00\x02" + bytes(padding) + b"\x00" + chunk
+
+def unpad(block):
+    separator = block.find(b"\x00", 2)
+    if block[:2] != b"\x00\x02" or separator < 10:
+        raise ValueError("Corrupted block: bad padding")
+    return block[separator + 1:]
+
+def encrypt_batch(chunks):
+    key = worker_key()
+    N, a = key["N"], key["a"]
+    width = modulus_width(N)
+    return b"".join(pow(int.from_bytes(pad(chunk, width), byteorder='big'), a, N).to_bytes(width, byteorder='big')
+                    for chunk in chunks)
+
+def decrypt_batch(records):
+    # CRT decryption with the re-encryption check (see rsa.decrypt)
+    key = rsa.RSAPrivateKey(**worker_key())
+    width = modulus_width(key.N)
+    return b"".join(unpad(rsa.decrypt(int.from_bytes(record, byteorder='big'), key).to_bytes(width, byteorder='big'))
+                    for record in records)
+
+# Ciphertext file: magic "RSS1", 2-byte modulus width k, then one k-byte record per block (see streaming.py)
+CIPHER = BlockCipher(
+    name="RSA", magic=b"RSS1", elements=1,
+    width=lambda key: modulus_width(key["N"]),
+    payload_size=lambda key: payload_size(key["N"]),
+    public=lambda key: {"N": key["N"], "a": key["a"]},
+    private=lambda key: key,
+    encrypt_batch=encrypt_batch, decrypt_batch=decrypt_batch,
+    generate_key=lambda args: rsa.generate_key(args.bits)._asdict())
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = streaming.build_parser(
+        prog=prog,
+        description=textwrap.dedent(
+        """
+        Encrypts and decrypts arbitrary byte streams with RSA in block mode \n
+        Input is split in PKCS#1 v1.5 padded blocks below N, processed in order by a pool of worker processes \n
+        ** THIS IS NOT A SECURE IMPLEMENTATION OF RSA ** \n
+        """),
+        epilog=textwrap.dedent(
+        """
+        Example usages:
+        python src/rsa_stream.py keygen key.json
+        python src/rsa_stream.py encrypt key.json -i big.bin -o big.rss
+        cat big.rss | python src/rsa_stream.py decrypt key.json > big.out
+        """))
+    parser.add_argument('--bits', type=int, default=1024, help='Size of each prime for keygen. Defaults to 1024')
+    return parser
+
+def run(args):
+    streaming.run(CIPHER, args)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,216 @@
+import argparse
+import json
+import textwrap
+import math
+import random
+import os
+import itertools
+import multiprocessing
+import queue
+
+import backend_selection
+import shor_order
+from instrumentation import span
+
+
+def continued_fraction(numerator, denominator):
+    # Coefficients [a0; a1, a2, ...] of numerator/denominator
+    coefficients = []
+    while denominator != 0:
+        coefficients.append(numerator // denominator)
+        numerator, denominator = denominator, numerator % denominator
+    return coefficients
+
+def convergent_denominators(numerator, denominator, limit):
+    # Denominators q of the convergents p/q of numerator/denominator, stopping once q >= limit
+    q_prev, q = 0, 1
+    for coefficient in continued_fraction(numerator, denominator)[1:]:
+        q_prev, q = q, coefficient * q + q_prev
+        if q >= limit:
+            break
+        yield q
+
+def order_from_counts(a, N, counts, eval_qubits):
+    # Each measurement y gives y/2^t ~ s/r. Convergent denominators are divisors of r (when gcd(s, r) != 1)
+    # so small multiples of them, and lcms between measurements, are also tried
+    candidates = set()
+    for y, _ in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        for q in convergent_denominators(y, 2 ** eval_qubits, N):
+            for known in list(candidates) + [1]:
+                candidate = q * known // math.gcd(q, known)
+                if candidate < N:
+                    candidates.add(candidate)
+
+    # Classical check of the candidates: the order is the smallest r with a^r = 1 (mod N)
+    for r in sorted(candidates):
+        if pow(a, r, N) == 1:
+            return r
+    return None
+
+def factors_from_order(a, N, r):
+    # Needs r even and a^(r/2) != -1 (mod N)
+    if r is None or r % 2 == 1:
+        return None
+    x = pow(a, r // 2, N)
+    if x == N - 1:
+        return None
+    for candidate in (math.gcd(x - 1, N), math.gcd(x + 1, N)):
+        if 1 < candidate < N:
+            return candidate, N // candidate
+    return None
+
+def is_prime(N):
+    # Trial division is enough for the sizes the simulator can handle
+    return N > 1 and all(N % d for d in range(2, math.isqrt(N) + 1))
+
+def classical_factor(N):
+    # Cases Shor's reduction does not cover: even N and prime powers
+    if N % 2 == 0:
+        return 2, N // 2
+    for k in range(2, N.bit_length() + 1):
+        b = round(N ** (1 / k))
+        for root in (b - 1, b, b + 1):
+            if root > 1 and pow(root, k) == N:
+                return root, N // root
+    return None
+
+def try_base(a, N, oracle="matrix", shots=1024, engine="aer"):
+    # Runs in a worker process: quantum order finding followed by the classical post-processing
+    with span("shor.try_base", a=a, N=N) as base_span:
+        with span("order_finding", engine=engine):
+            counts = shor_order.run_order_finding(a, N, oracle, shots, engine)
+        _, eval_qubits = shor_order.register_sizes(N)
+        with span("continued_fractions"):
+            r = order_from_counts(a, N, counts, eval_qubits)
+        base_span.set(order=r)
+    return {"a": a, "order": r, "factors": factors_from_order(a, N, r)}
+
+def candidate_bases(N, max_bases=None, seed=None):
+    # Only bases coprime to N go through order finding. Any other base would hand out gcd(a, N) as a factor
+    # without needing the quantum core
+    bases = [a for a in range(2, N - 1) if math.gcd(a, N) == 1]
+    random.Random(seed).shuffle(bases)
+    if max_bases is not None:
+        bases = bases[:max_bases]
+    return bases
+
+def factor(N, oracle="matrix", shots=1024, workers=None, max_bases=None, seed=None, engine="aer", verbose=True,
+           max_memory=None, precision=None):
+    trivial = classical_factor(N)
+    if trivial is not None:
+        return {"a": None, "order": None, "factors": trivial}
+
+    bases = candidate_bases(N, max_bases, seed)
+    if not bases:
+        return None
+
+    # Keep at most one base per worker in flight, so that finding a factor leaves nothing queued
+    # Results come back through the pool's callbacks, in the order the bases finish
+    # Worker processes share the machine, so each Aer run gets one thread. A single worker lets backend_selection choose
+    workers = workers or os.cpu_count() or 1
+    threads = 1 if workers > 1 else None
+    pool = multiprocessing.Pool(processes=workers, initializer=backend_selection.configure,
+                                initargs=(max_memory, precision, threads))
+    results = queue.Queue()
+    in_flight = 0
+    found = None
+    remaining = iter(bases)
+
+    def submit(count):
+        for a in itertools.islice(remaining, count):
+            pool.apply_async(try_base, (a, N, oracle, shots, engine), callback=results.put, error_callback=results.put)
+            yield a
+
+    try:
+        in_flight += len(list(submit(workers)))
+        while in_flight and found is None:
+            result = results.get()
+            in_flight -= 1
+            if isinstance(result, BaseException):
+                raise result
+            if verbose:
+                print(f"a = {result['a']}: order = {result['order']}, factors = {result['factors']}")
+            if result["factors"] is not None:
+                found = result
+            else:
+                in_flight += len(list(submit(1)))
+    finally:
+        # Early cancellation: bases still running once a factor is found (or on an error) are of no use, and a matrix
+        # oracle base can take minutes, so the pool's worker processes are terminated rather than waited for
+        if in_flight:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    return found
+
+def main(N, oracle="matrix", shots=1024, workers=None, max_bases=None, seed=None, engine="aer", headless=False,
+         max_memory=None, precision=None):
+    # Headless: the only output is one JSON object on stdout
+    if headless:
+        result = factor(N, oracle, shots, workers, max_bases, seed, engine, False, max_memory, precision)
+        print(json.dumps({"N": N, "result": result}))
+        return result
+
+    # Acknowledge user input
+    print(f"Factor N = {N}")
+
+    result = factor(N, oracle, shots, workers, max_bases, seed, engine, True, max_memory, precision)
+    if result is None:
+        print("No factor found. Try more bases or shots")
+    elif result["order"] is None:
+        print(f"Found classically: {N} = {result['factors'][0]} x {result['factors'][1]}")
+    else:
+        print(f"Order of {result['a']} in Z_{N} is r = {result['order']}")
+        print(f"Found: {N} = {result['factors'][0]} x {result['factors'][1]}")
+    return result
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+            """
+            Factors N with Shor's algorithm: order finding on the quantum core of shor_order.py \n
+            followed by continued-fraction post-processing. Independent bases a run in parallel processes \n
+            and the run stops as soon as one of them yields a factor
+            """),
+        epilog=textwrap.dedent(
+            """
+            Example usages:
+            python src/shor.py -N 15
+            python src/shor.py -N 21 --oracle permutation -w 4
+            python src/shor.py -N 221 --engine numpy
+            python src/shor.py -N 221 --engine numpy --headless > result.json
+            """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-N', nargs=1, type=int, help='Integer N to be factored', required=True)
+    parser.add_argument('--oracle', choices=['matrix', 'permutation'], default='matrix',
+                        help='How controlled-U^(2^i) gates are built (see shor_order.py). Defaults to matrix')
+    parser.add_argument('--engine', choices=['aer', 'numpy'], default='aer',
+                        help='Simulation engine for the quantum core (see shor_order.py). Defaults to aer')
+    parser.add_argument('-s', '--shots', type=int, default=1024, help='Shots per base. Defaults to 1024')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes. Defaults to CPU count')
+    parser.add_argument('--max-bases', type=int, default=None, help='Maximum number of bases a to try')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the order in which bases are tried')
+    parser.add_argument('--headless', action='store_true', help='Batch mode: result printed as JSON')
+    # Threads follow from the number of workers
+    backend_selection.add_arguments(parser, threads=False)
+    return parser
+
+def run(args):
+    N = abs(args.N[0])
+    backend_selection.configure_from(args)
+
+    if N < 4:
+        print(json.dumps({"error": "Invalid arguments"}) if args.headless else "Invalid arguments")
+    elif is_prime(N):
+        print(json.dumps({"N": N, "prime": True}) if args.headless else f"{N} is prime")
+    else:
+        with span("shor.main", N=N, oracle=args.oracle, engine=args.engine):
+            main(N, args.oracle, args.shots, args.workers, args.max_bases, args.seed, args.engine, args.headless,
+                 args.max_memory, args.precision)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -1,19 +1,24 @@
 import argparse
+import json
 import textwrap
 
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
 from qiskit import Aer, transpile
 
-from qiskit.tools.visualization import plot_histogram
-
 from qiskit.circuit.library import QFT
 
-from qiskit.extensions import UnitaryGate
+from qiskit.circuit.library import MCXGate
 
-import matplotlib.pyplot as plt
 import numpy as np
 import math
 
+from power_cache import default_cache
+from circuit_cache import cached_transpile
+import backend_selection
+from backend_selection import prepare
+from instrumentation import span
+from statevector_sampling import exact_probabilities, nonzero_probabilities, sample_counts, total_variation_distance
+
 def generate_base_matrix(a, N, eigen_qubits):
     # Build the matrix, which must support 2**eigen_qubits elements
     u = np.zeros([2 ** eigen_qubits, 2 ** eigen_qubits], dtype=int)
@@ -27,16 +32,91 @@ def generate_base_matrix(a, N, eigen_qubits):
 
     return u
 
-def main(a, N):
-    # Acknowledge user input
-    print(f"Find order of element {a} in Z_{N}")
+def modular_powers(a, N, count):
+    # a^(2^i) mod N for 0 <= i < count, each one obtained by squaring the previous
+    powers = [a % N]
+    for i in range(1, count):
+        powers.append(powers[-1] * powers[-1] % N)
+    return powers
+
+def generate_permutation(multiplier, N, eigen_qubits):
+    # Same map as generate_base_matrix, but stored as perm[i] = U|i> instead of a dense matrix
+    perm = np.arange(2 ** eigen_qubits, dtype=np.int64)
+    perm[:N] = (multiplier * np.arange(N, dtype=np.int64)) % N
+    return perm
+
+def controlled_permutation_gate(perm, eigen_qubits, label=None):
+    # Qubit 0 is the control, qubits 1..eigen_qubits hold the eigenstate register
+    qc = QuantumCircuit(eigen_qubits + 1, name=label)
+
+    # Split the permutation in cycles c0 -> c1 -> ... -> cm-1 -> c0
+    # The cycle is the product of transpositions (c0 c1)(c1 c2)...(cm-2 cm-1), applied right to left
+    visited = np.zeros(perm.size, dtype=bool)
+    visited[perm == np.arange(perm.size)] = True  # Fixed points need no gates
+    for start in np.flatnonzero(~visited):
+        if visited[start]:
+            continue
+        cycle = [int(start)]
+        visited[start] = True
+        while not visited[perm[cycle[-1]]]:
+            cycle.append(int(perm[cycle[-1]]))
+            visited[cycle[-1]] = True
+        for j in range(len(cycle) - 2, -1, -1):
+            _append_controlled_transposition(qc, cycle[j], cycle[j + 1], eigen_qubits)
+
+    return qc.to_gate()
 
+def _append_controlled_transposition(qc, x, y, eigen_qubits):
+    # Swap basis states |x> and |y> of the eigen register when the control (qubit 0) is |1>
+    diff = x ^ y
+    pivot = diff.bit_length() - 1
+    others = [bit for bit in range(eigen_qubits) if (diff >> bit) & 1 and bit != pivot]
+
+    # Conjugating CNOTs send |y> to |x with pivot flipped> and leave |x> untouched
+    conjugation = QuantumCircuit(eigen_qubits + 1)
+    for bit in others:
+        conjugation.cx(pivot + 1, bit + 1, ctrl_state=(y >> pivot) & 1)
+
+    # Flip the pivot when the control is set and every other eigen qubit matches x
+    controls = [0] + [bit + 1 for bit in range(eigen_qubits) if bit != pivot]
+    ctrl_state = "".join(str((x >> bit) & 1) for bit in reversed(range(eigen_qubits)) if bit != pivot) + "1"
+    qc.compose(conjugation, inplace=True)
+    qc.append(MCXGate(len(controls), ctrl_state=ctrl_state), [*controls, pivot + 1])
+    qc.compose(conjugation, inplace=True)
+
+def register_sizes(N):
     # Calculate size of the eigenstate register
     eigen_qubits = math.ceil(np.log2(N))
     # Calculate size of the evaluation register
     eval_qubits = math.ceil(np.log2(pow(N, 2)))
-    print(f"Eigenstate qubits: {eigen_qubits}")
-    print(f"Evaluation qubits: {eval_qubits}")
+    return eigen_qubits, eval_qubits
+
+def controlled_power_gates(a, N, oracle="matrix"):
+    # Controlled-U^(2^i) for 0 <= i < eval_qubits. Qubit 0 of each gate is the control, the rest the eigen register
+    # Gates are memoized per (a, N) and exponent, so repeated builds skip synthesis
+    eigen_qubits, eval_qubits = register_sizes(N)
+    gates = []
+    if oracle == "permutation":
+        # U^(2^i) is multiplication by a^(2^i) mod N, so no matrix powers are needed
+        for i, multiplier in enumerate(modular_powers(a, N, eval_qubits)):
+            with span("permutation_gate", exponent=2 ** i):
+                gates.append(default_cache.controlled_gate(
+                    ("permutation", a, N), i,
+                    lambda: controlled_permutation_gate(generate_permutation(multiplier, N, eigen_qubits), eigen_qubits,
+                                                        label=f"CU{2 ** i}")))
+    else:
+        u = None
+        for i in range(eval_qubits):
+            if u is None and not default_cache.has_gate(("matrix", a, N), i):
+                with span("generate_base_matrix", N=N):
+                    u = generate_base_matrix(a, N, eigen_qubits)
+            gates.append(default_cache.controlled_unitary_power(u, i, label=f"CU{2 ** i}", key=("matrix", a, N)))
+        # Every gate is built, the dense powers are no longer needed
+        default_cache.release_powers(("matrix", a, N))
+    return gates
+
+def build_circuit(a, N, oracle="matrix"):
+    eigen_qubits, eval_qubits = register_sizes(N)
 
     # Build circuit structure
     eigen_register = []
@@ -56,13 +136,7 @@ def main(a, N):
         qc.h(i + eigen_qubits)
 
     # Build controlled rotations
-    u = generate_base_matrix(a, N, eigen_qubits)
-    for i in range(eval_qubits):
-        power = pow(2, i)
-        compound_u = np.linalg.matrix_power(u, power)
-        compound_u_gate = UnitaryGate(compound_u)
-        compound_u_gate.name = f"CU{2 ** i}"
-        controlled_u_gate = compound_u_gate.control()
+    for i, controlled_u_gate in enumerate(controlled_power_gates(a, N, oracle)):
         qc.append(controlled_u_gate, [i + eigen_qubits, *list(range(eigen_qubits))])
 
     # Inverse qft
@@ -74,28 +148,202 @@ def main(a, N):
     for i in range(eval_qubits):
         qc.measure(i + eigen_qubits, i)
 
-    # Draw
-    qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
+    return qc
+
+def build_semiclassical_circuit(a, N, oracle="matrix"):
+    # Same measured distribution as build_circuit, with the whole evaluation register replaced by one control qubit
+    # (Griffiths-Niu semiclassical inverse QFT). Round k applies U^(2^(t-1-k)), whose phase is y/2^(k+1) mod 1,
+    # removes the contribution of the bits y_0 .. y_k-1 already measured and measures bit y_k, least significant first
+    # The register holds eigen_qubits + 1 qubits instead of eigen_qubits + eval_qubits
+    eigen_qubits, eval_qubits = register_sizes(N)
 
+    eigen_register = []
+    for i in range(eigen_qubits):
+        eigen_register.append(QuantumRegister(1, f"eigen{i}"))
+    outcome = ClassicalRegister(eval_qubits)
+    qc = QuantumCircuit(*eigen_register, QuantumRegister(1, "control"), outcome)
+    control = eigen_qubits
+
+    # Start state |1> on eigenstate register
+    qc.x(0)
+
+    gates = controlled_power_gates(a, N, oracle)
+    for k in range(eval_qubits):
+        qc.h(control)
+        qc.append(gates[eval_qubits - 1 - k], [control, *list(range(eigen_qubits))])
+        # Phase corrections: bit j < k adds y_j/2^(k+1-j) to the phase, removed when y_j was measured as 1
+        for j in range(k):
+            qc.p(-np.pi / 2 ** (k - j), control).c_if(outcome[j], 1)
+        qc.h(control)
+        qc.measure(control, outcome[k])
+        if k < eval_qubits - 1:
+            qc.reset(control)
+
+    return qc
+
+def get_transpiled(a, N, oracle="matrix", simulator=None, use_cache=True, qft="full"):
+    # Returns (transpiled circuit, built circuit). On a cache hit nothing is built and the second value is None
+    simulator = simulator or Aer.get_backend('aer_simulator')
+    params = {"a": a, "N": N, "oracle": oracle}
+    if qft == "semiclassical":
+        return cached_transpile("shor_order_semiclassical", params, lambda: build_semiclassical_circuit(a, N, oracle),
+                                simulator, use_cache)
+    return cached_transpile("shor_order", params, lambda: build_circuit(a, N, oracle), simulator, use_cache)
+
+def run_circuit(qc, shots=1024):
     # Compile and run
     simulator = Aer.get_backend('aer_simulator')
-    transpiled = transpile(qc, simulator)
+    return run_transpiled(transpile(qc, simulator), shots, simulator)
 
-    result = simulator.run(transpiled).result()
+def run_transpiled(transpiled, shots=1024, simulator=None):
+    simulator = simulator or Aer.get_backend('aer_simulator')
+    circuit, decision = prepare(transpiled)
+    with span("aer_run", shots=shots, method=decision["method"]) as run_span:
+        result = simulator.run(circuit, shots=shots, **decision["options"]).result()
+        run_span.aer_result(result)
     data = result.get_counts()
     # Pass data to decimal for easier inspection
     data_dec = dict()
     for bin_key in data.keys():
         data_dec[int(bin_key, 2)] = data[bin_key]
+    return data_dec
+
+def exact_probabilities_numpy(a, N, block_size=2 ** 22):
+    # Outcome distribution of the evaluation register computed without building any circuit
+    # After the controlled-U stage the state is 2^(-t/2) sum_k |k>|a^k mod N>, so every eigen register value v
+    # selects the indices k with a^k = v. The inverse QFT on k is a (normalized) FFT over each of these selections
+    _, eval_qubits = register_sizes(N)
+    M = 2 ** eval_qubits
+
+    # a^k mod N for every k at once, multiplying in a^(2^i) wherever bit i of k is set
+    k = np.arange(M, dtype=np.int64)
+    values = np.ones(M, dtype=np.int64)
+    for i, multiplier in enumerate(modular_powers(a, N, eval_qubits)):
+        bit_set = ((k >> i) & 1).astype(bool)
+        values[bit_set] = values[bit_set] * multiplier % N
+    _, column = np.unique(values, return_inverse=True)
+    columns = column.max() + 1
+
+    # P(y) = sum_v |FFT(indicator_v)(y)|^2 / M^2, accumulated a few eigen values at a time to bound memory
+    # Indicators are real, so P(M - y) = P(y) and the real FFT gives the whole distribution
+    half = np.zeros(M // 2 + 1)
+    step = max(1, block_size // M)
+    for first in range(0, columns, step):
+        selected = (column >= first) & (column < first + step)
+        indicator = np.zeros((M, min(step, columns - first)))
+        indicator[k[selected], column[selected] - first] = 1
+        amplitudes = np.fft.rfft(indicator, axis=0) / M
+        half += np.sum(np.abs(amplitudes) ** 2, axis=1)
+    return np.concatenate([half, half[1:M // 2][::-1]])
+
+def simulate_numpy(a, N, shots=1024, seed=None):
+    return sample_counts(exact_probabilities_numpy(a, N), shots, seed)
+
+def validate_numpy_engine(a, N, oracle="matrix", tolerance=1e-6):
+    # Compare the NumPy distribution with Aer's exact probabilities for the same circuit
+    from qiskit.providers.aer.library import SaveProbabilities  # Loads all of Aer, so only when validating
+
+    eigen_qubits, eval_qubits = register_sizes(N)
+    qc = build_circuit(a, N, oracle)
+    qc.remove_final_measurements()
+    qc.append(SaveProbabilities(eval_qubits), [i + eigen_qubits for i in range(eval_qubits)])
+
+    simulator = Aer.get_backend('aer_simulator')
+    circuit, decision = prepare(transpile(qc, simulator))
+    result = simulator.run(circuit, shots=1, **decision["options"]).result()
+    aer_probabilities = np.asarray(result.data()["probabilities"])
+
+    difference = np.max(np.abs(aer_probabilities - exact_probabilities_numpy(a, N)))
+    return difference <= tolerance, difference
+
+def run_order_finding(a, N, oracle="matrix", shots=1024, engine="aer", seed=None, use_cache=True, qft="full"):
+    # Quantum core only: measured evaluation register values y, with y/2^eval_qubits ~ s/r
+    if qft == "semiclassical" and engine != "aer":
+        raise ValueError("The semiclassical QFT needs the aer engine")
+    if engine == "numpy":
+        return simulate_numpy(a, N, shots, seed)
+    simulator = Aer.get_backend('aer_simulator')
+    transpiled, _ = get_transpiled(a, N, oracle, simulator, use_cache, qft)
+    if engine == "statevector":
+        return sample_counts(exact_probabilities(transpiled, simulator), shots, seed)
+    return run_transpiled(transpiled, shots, simulator)
+
+def main(a, N, oracle="matrix", engine="aer", shots=1024, seed=None, validate=False, use_cache=True, headless=False,
+         qft="full"):
+    # Headless: nothing is drawn or plotted and the only output is one JSON object on stdout
+    eigen_qubits, eval_qubits = register_sizes(N)
+    result = {"a": a, "N": N, "oracle": oracle, "engine": engine, "qft": qft, "shots": shots,
+              "eigen_qubits": eigen_qubits, "eval_qubits": eval_qubits}
+
+    # Acknowledge user input
+    if not headless:
+        print(f"Find order of element {a} in Z_{N}")
+        print(f"Eigenstate qubits: {eigen_qubits}")
+        if qft == "semiclassical":
+            print(f"Evaluation bits: {eval_qubits}, measured one at a time on a single control qubit")
+        else:
+            print(f"Evaluation qubits: {eval_qubits}")
+
+    if validate:
+        matches, difference = validate_numpy_engine(a, N, oracle)
+        result["validation"] = {"matches": bool(matches), "max_difference": float(difference)}
+        if not headless:
+            print(f"NumPy engine matches Aer: {matches} (max probability difference {difference:.2e})")
+
+    if engine == "numpy":
+        # No circuit is built, so there is nothing to draw
+        with span("numpy_simulation", N=N, shots=shots):
+            data_dec = simulate_numpy(a, N, shots, seed)
+    else:
+        simulator = Aer.get_backend('aer_simulator')
+        transpiled, qc = get_transpiled(a, N, oracle, simulator, use_cache, qft)
+        result["cached"] = qc is None
+
+        # Draw. A cached circuit is already transpiled, so only a freshly built one is worth drawing
+        if not headless:
+            if qc is not None:
+                with span("draw"):
+                    qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
+            else:
+                print("Transpiled circuit loaded from cache")
+
+        if engine == "statevector":
+            # One simulation without measurements, then any number of shots drawn from the exact distribution
+            probabilities = exact_probabilities(transpiled, simulator)
+            result["probabilities"] = nonzero_probabilities(probabilities)
+            with span("sampling", shots=shots):
+                data_dec = sample_counts(probabilities, shots, seed)
+        else:
+            data_dec = run_transpiled(transpiled, shots, simulator)
+
+        if qft == "semiclassical":
+            # Measured one bit at a time, the histogram should still follow the full inverse QFT distribution
+            distance = total_variation_distance(data_dec, exact_probabilities_numpy(a, N))
+            result["total_variation_distance"] = float(distance)
+            if not headless:
+                print(f"Total variation distance to the exact distribution: {distance:.4f}")
+    result["counts"] = data_dec
+
+    if headless:
+        print(json.dumps(result))
+        return result
+
+    # Plotting modules are only loaded when something is going to be shown
+    import matplotlib.pyplot as plt
+    from qiskit.tools.visualization import plot_histogram
+
     print(data_dec)
-    plot_histogram(data_dec, title=f"Shor results for N={N} a={a} - {eval_qubits} eval qubits")
+    with span("plot"):
+        plot_histogram(data_dec, title=f"Shor results for N={N} a={a} - {eval_qubits} eval qubits")
 
     # Show all images
     plt.show()
+    return result
 
-if __name__ == "__main__":
+def build_parser(prog=None):
     # Script instruction
     parser = argparse.ArgumentParser(
+        prog=prog,
         description=textwrap.dedent(
             """
             Performs quantum core of Shor's order-finding algorithm on element a in group Z_N \n 
@@ -105,16 +353,65 @@ if __name__ == "__main__":
             """
             Example usages: 
             python src/shor_order.py -a 5 -N 13
+            python src/shor_order.py -a 5 -N 13 --oracle permutation
+            python src/shor_order.py -a 7 -N 15 --engine numpy --validate
+            python src/shor_order.py -a 7 -N 15 --oracle permutation --engine statevector -s 1000000
+            python src/shor_order.py -a 2 -N 33 --oracle permutation --qft semiclassical
+            python src/shor_order.py -a 7 -N 15 --headless > result.json
             """),
         formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-a', nargs=1, type=int, help='Element a in Z_N whose order we wish to find', required=True)
     parser.add_argument('-N', nargs=1, type=int, help='Integer N defining the modular algebra size', required=True)
-    args = parser.parse_args()
+    parser.add_argument('--oracle', choices=['matrix', 'permutation'], default='matrix',
+                        help=textwrap.dedent(
+                            """
+                            How controlled-U^(2^i) gates are built. Defaults to matrix
+                            matrix: dense matrix powers wrapped in UnitaryGate (O(4^n) memory)
+                            permutation: a^(2^i) mod N by repeated squaring, synthesized as a permutation (O(2^n) memory)
+                            """))
+    parser.add_argument('--engine', choices=['aer', 'numpy', 'statevector'], default='aer',
+                        help=textwrap.dedent(
+                            """
+                            Simulation engine. Defaults to aer
+                            aer: build, transpile and run the circuit on aer_simulator
+                            numpy: compute the outcome distribution with NumPy index arithmetic and FFT, then sample it
+                            statevector: simulate the circuit once without measurements, marginalize the statevector
+                            onto the evaluation register and sample it (shots cost nothing extra)
+                            """))
+    parser.add_argument('--qft', choices=['full', 'semiclassical'], default='full',
+                        help=textwrap.dedent(
+                            """
+                            How the evaluation register is read out. Defaults to full
+                            full: eval_qubits control qubits followed by the inverse QFT (eigen + eval qubits)
+                            semiclassical: one control qubit, measured and reset after each controlled power, with
+                            classically conditioned phase corrections (eigen + 1 qubits). aer engine only
+                            """))
+    parser.add_argument('-s', '--shots', type=int, default=1024, help='Number of shots. Defaults to 1024')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the numpy and statevector engine sampling')
+    parser.add_argument('--validate', action='store_true', help='Check the numpy engine against Aer before running')
+    parser.add_argument('--no-cache', action='store_true', help='Always build and transpile, skipping the on-disk circuit cache')
+    parser.add_argument('--headless', action='store_true', help='Batch mode: no drawing or plots, results printed as JSON')
+    backend_selection.add_arguments(parser)
+    return parser
 
+def run(args):
     a = abs(args.a[0])
     N = abs(args.N[0])
 
     if N == 0 or math.gcd(a, N) != 1 or a > N:
-        print("Invalid arguments")
+        print(json.dumps({"error": "Invalid arguments"}) if args.headless else "Invalid arguments")
+    elif args.qft == "semiclassical" and args.engine != "aer":
+        # Mid-circuit measurements leave no final statevector, and the numpy engine builds no circuit at all
+        error = "The semiclassical QFT needs the aer engine"
+        print(json.dumps({"error": error}) if args.headless else error)
     else:
-        main(a, N)
+        backend_selection.configure_from(args, verbose=not args.headless)
+        try:
+            with span("shor_order.main", a=a, N=N, oracle=args.oracle, engine=args.engine, qft=args.qft):
+                main(a, N, args.oracle, args.engine, args.shots, args.seed, args.validate, not args.no_cache,
+                     args.headless, args.qft)
+        except MemoryError as error:
+            print(json.dumps({"error": str(error)}) if args.headless else error)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,202 @@
+import argparse
+import csv
+import math
+import os
+import textwrap
+
+import backend_selection
+import shor_order
+from instrumentation import span
+from streaming import batched, ordered_parallel_map
+
+# One row per measured outcome of one (a, N) pair
+COLUMNS = ["N", "a", "oracle", "engine", "shots", "eval_qubits", "y", "count"]
+
+
+def valid_pairs(N_values, max_bases=None):
+    # Every base 2 <= a < N coprime to N, or the first max_bases of them
+    for N in N_values:
+        bases = [a for a in range(2, N) if math.gcd(a, N) == 1]
+        for a in bases[:max_bases]:
+            yield N, a
+
+def run_batch(job):
+    # Runs in a worker process. All circuits of the batch go to Aer in a single job
+    pairs, oracle, engine, shots, seed, threads, max_memory, precision = job
+    with span("shor_sweep.batch", pairs=len(pairs), engine=engine):
+        if engine == "numpy":
+            counts = [shor_order.simulate_numpy(a, N, shots, None if seed is None else [seed, N, a])
+                      for N, a in pairs]
+        else:
+            simulator = shor_order.Aer.get_backend('aer_simulator')
+            circuits = [shor_order.get_transpiled(a, N, oracle, simulator)[0] for N, a in pairs]
+            circuits, decision = backend_selection.prepare(circuits, max_memory, precision, threads)
+            options = {"shots": shots, **decision["options"]}
+            if seed is not None:
+                options["seed_simulator"] = seed
+            with span("aer_run", circuits=len(circuits), method=decision["method"]) as run_span:
+                result = simulator.run(circuits, **options).result()
+                run_span.aer_result(result)
+            counts = [{int(key, 2): value for key, value in result.get_counts(i).items()} for i in range(len(pairs))]
+
+    rows = []
+    for (N, a), pair_counts in zip(pairs, counts):
+        _, eval_qubits = shor_order.register_sizes(N)
+        rows += [(N, a, oracle, engine, shots, eval_qubits, y, count) for y, count in sorted(pair_counts.items())]
+    return rows
+
+class CSVSink:
+    # Rows appended to one CSV file, flushed after every batch
+    def __init__(self, path):
+        self.path = path
+
+    def completed(self):
+        # Runs already in the file, as {(N, a, oracle, engine, shots)}. A sweep killed mid-write leaves a torn last
+        # line and possibly a pair whose counts fall short of its shots: only those are dropped, so the pair is run again
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline="") as f:
+            lines = f.read().splitlines(keepends=True)
+        rows = list(csv.DictReader(line for line in lines if line.endswith("\n")))
+        totals = dict()
+        for row in rows:
+            key = run_key(row)
+            totals[key] = totals.get(key, 0) + int(row["count"])
+        done = {key for key, total in totals.items() if total == key[4]}
+        if len(done) != len(totals) or (lines and not lines[-1].endswith("\n")):
+            with open(self.path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMNS)
+                writer.writerows([row[column] for column in COLUMNS] for row in rows if run_key(row) in done)
+        return done
+
+    def write(self, rows):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(COLUMNS)
+            writer.writerows(rows)
+
+class ParquetSink:
+    # A directory of part files, one per batch. Each part is written aside and renamed, so it is complete or absent
+    def __init__(self, path):
+        import pyarrow  # Optional dependency, only needed for Parquet output
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.parts = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+
+    def completed(self):
+        # Parts are complete by construction, so every run in them is done
+        import pyarrow.parquet as pq
+        if self.parts == 0:
+            return set()
+        table = pq.read_table(self.path, columns=["N", "a", "oracle", "engine", "shots"])
+        return {run_key(row) for row in table.to_pylist()}
+
+    def write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pydict({column: [row[i] for row in rows] for i, column in enumerate(COLUMNS)})
+        path = os.path.join(self.path, f"part-{self.parts:06d}.parquet")
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.parts += 1
+
+def run_key(row):
+    # What identifies a finished run of one pair, whether the row comes from CSV (strings) or Parquet
+    return int(row["N"]), int(row["a"]), row["oracle"], row["engine"], int(row["shots"])
+
+def remove_results(path):
+    # A CSV file is removed. For a Parquet directory only the parts a sweep writes are, so nothing else in it is lost
+    if os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        for name in os.listdir(path):
+            if name.startswith("part-") and name.endswith((".parquet", ".parquet.tmp")):
+                os.remove(os.path.join(path, name))
+
+def open_sink(path):
+    return ParquetSink(path) if path.endswith(".parquet") else CSVSink(path)
+
+def main(N_values, output, oracle="permutation", engine="aer", shots=1024, workers=None, circuits_per_job=16,
+         max_bases=None, seed=None, overwrite=False, max_memory=None, precision=None):
+    if overwrite:
+        remove_results(output)
+    sink = open_sink(output)
+    runs = sink.completed()
+    done = {(N, a) for N, a, *parameters in runs if parameters == [oracle, engine, shots]}
+    others = {tuple(parameters) for _, _, *parameters in runs if parameters != [oracle, engine, shots]}
+    if others:
+        # Kept as they are: the oracle, engine and shots columns tell the runs apart
+        print(f"Warning: {output} also holds runs with other (oracle, engine, shots): "
+              f"{', '.join(str(parameters) for parameters in sorted(others))}")
+    pairs = [pair for pair in valid_pairs(N_values, max_bases) if pair not in done]
+    print(f"{len(done)} pairs already in {output}, {len(pairs)} to run")
+    if not pairs:
+        return
+
+    # Worker processes share the machine, so each Aer job gets one thread. A single worker lets backend_selection choose
+    workers = workers or os.cpu_count() or 1
+    threads = 1 if workers > 1 else None
+    jobs = ((batch, oracle, engine, shots, seed, threads, max_memory, precision)
+            for batch in batched(pairs, circuits_per_job))
+    finished = 0
+    for rows in ordered_parallel_map(run_batch, jobs, workers):
+        sink.write(rows)
+        finished += len({(row[0], row[1]) for row in rows})
+        print(f"{finished}/{len(pairs)} pairs", end="\r", flush=True)
+    print()
+
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+            """
+            Sweeps the quantum core of shor_order.py over every valid base a of every N in a range \n
+            Circuits are sent to Aer several per job, in a pool of worker processes, and the counts are appended to \n
+            a CSV file (or a directory of Parquet files, with pyarrow). Running it again resumes an interrupted sweep
+            """),
+        epilog=textwrap.dedent(
+            """
+            Example usages:
+            python src/shor_sweep.py --N-min 15 --N-max 35 -o sweep.csv
+            python src/shor_sweep.py --N-min 15 --N-max 63 --engine numpy -o sweep.parquet
+            python src/shor_sweep.py --N 15 21 33 --max-bases 4 -w 4 -o sweep.csv
+            """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--N', nargs='+', type=int, default=None, help='Values of N to sweep')
+    parser.add_argument('--N-min', type=int, default=None, help='Smallest N of a range')
+    parser.add_argument('--N-max', type=int, default=None, help='Largest N of a range')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='Results file. A path ending in .parquet is a directory of Parquet parts, anything else is CSV')
+    parser.add_argument('--oracle', choices=['matrix', 'permutation'], default='permutation',
+                        help='How controlled-U^(2^i) gates are built (see shor_order.py). Defaults to permutation')
+    parser.add_argument('--engine', choices=['aer', 'numpy'], default='aer',
+                        help='Simulation engine (see shor_order.py). Defaults to aer')
+    parser.add_argument('-s', '--shots', type=int, default=1024, help='Shots per pair. Defaults to 1024')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes. Defaults to CPU count')
+    parser.add_argument('--circuits-per-job', type=int, default=16, help='Circuits per Aer job. Defaults to 16')
+    parser.add_argument('--max-bases', type=int, default=None, help='Only the first bases of each N')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the simulators')
+    parser.add_argument('--overwrite', action='store_true', help='Start over instead of resuming existing results')
+    # Threads follow from the number of workers
+    backend_selection.add_arguments(parser, threads=False)
+    return parser
+
+def run(args):
+    # Resets the settings of a previous job in the same process, which forked workers would otherwise inherit
+    backend_selection.configure_from(args)
+    N_values = list(args.N or [])
+    if args.N_min is not None and args.N_max is not None:
+        N_values += range(max(args.N_min, 3), args.N_max + 1)
+    if not N_values:
+        print("Give --N or both --N-min and --N-max")
+        return
+    with span("shor_sweep.main", N_values=len(N_values), engine=args.engine):
+        main(sorted(set(N_values)), args.output, args.oracle, args.engine, args.shots, args.workers,
+             args.circuits_per_job, args.max_bases, args.seed, args.overwrite, args.max_memory, args.precision)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
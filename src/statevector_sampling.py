@@ -0,0 +1,64 @@
+"""
+Exact outcome probabilities of a measured circuit from a single statevector simulation
+Terminal measurements are replaced by one saved statevector, whose probabilities are marginalized onto the measured
+qubits with NumPy. Any number of shots is then one multinomial draw over the outcomes (sample_counts), so a
+million-shot histogram costs the same as a 1024-shot one
+"""
+import numpy as np
+
+from backend_selection import prepare
+from instrumentation import span
+
+
+def measured_qubits(qc):
+    # Qubit indices ordered by the classical bit they are measured into, so outcome bit k is classical bit k
+    measured = dict()
+    for instruction in qc.data:
+        if instruction.operation.name == "measure":
+            measured[qc.find_bit(instruction.clbits[0]).index] = qc.find_bit(instruction.qubits[0]).index
+    return [measured[clbit] for clbit in sorted(measured)]
+
+def marginal_probabilities(probabilities, qubits, num_qubits):
+    # Sum |amplitude|^2 over every qubit not in qubits. Qubit q is axis num_qubits - 1 - q of the reshaped array
+    tensor = probabilities.reshape([2] * num_qubits)
+    kept = [num_qubits - 1 - q for q in qubits]
+    tensor = tensor.sum(axis=tuple(axis for axis in range(num_qubits) if axis not in kept))
+    # Remaining axes are in increasing order. Put qubits[0] last, so it ends up as the least significant bit
+    remaining = sorted(kept)
+    return tensor.transpose([remaining.index(axis) for axis in reversed(kept)]).reshape(-1)
+
+def exact_probabilities(qc, simulator):
+    # qc may be transpiled already (e.g. from the circuit cache): save_statevector needs no further transpilation
+    from qiskit.providers.aer.library import SaveStatevector  # Loads all of Aer, so only when this engine is used
+
+    qubits = measured_qubits(qc)
+    unmeasured = qc.remove_final_measurements(inplace=False)
+    unmeasured.append(SaveStatevector(unmeasured.num_qubits), unmeasured.qubits)
+    unmeasured, decision = prepare(unmeasured)
+    with span("statevector_run", qubits=unmeasured.num_qubits) as run_span:
+        result = simulator.run(unmeasured, shots=1, **decision["options"]).result()
+        run_span.aer_result(result)
+    statevector = np.asarray(result.data(0)["statevector"])
+    return marginal_probabilities(np.abs(statevector) ** 2, qubits, unmeasured.num_qubits)
+
+def nonzero_probabilities(probabilities, tolerance=1e-12):
+    # {outcome: probability} for the outcomes that can occur, small enough to print or dump as JSON
+    return {int(y): float(probabilities[y]) for y in np.flatnonzero(probabilities > tolerance)}
+
+def sample_counts(probabilities, shots=1024, seed=None):
+    # Single multinomial draw over all outcomes, keyed by decimal outcome. seed may also be a numpy Generator
+    rng = np.random.default_rng(seed)
+    drawn = rng.multinomial(shots, probabilities / probabilities.sum())
+    return {int(y): int(drawn[y]) for y in np.flatnonzero(drawn)}
+
+def bitstring_counts(counts, num_bits):
+    # Decimal keys to bitstrings like Aer's get_counts, e.g. for plot_histogram
+    return {format(y, f"0{num_bits}b"): count for y, count in counts.items()}
+
+def total_variation_distance(counts, probabilities):
+    # Distance between a measured histogram, with decimal or bitstring keys, and an exact distribution
+    shots = sum(counts.values())
+    empirical = np.zeros(probabilities.size)
+    for y, count in counts.items():
+        empirical[int(y, 2) if isinstance(y, str) else y] = count / shots
+    return 0.5 * np.sum(np.abs(empirical - probabilities))
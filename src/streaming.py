@@ -0,0 +1,165 @@
+"""
+Helpers for block-streaming pipelines over a process pool
+Work items are read lazily, at most max_inflight of them are in the pool at any time and results come back
+in input order, so memory stays flat however long the input is
+Block ciphers (rsa_stream.py, elgamal_stream.py) only supply a BlockCipher: the file framing, worker setup and
+command line are shared here
+"""
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+
+from collections import deque, namedtuple
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+# Ciphertext file: magic, 2-byte width, then one record of elements x width bytes per block
+# width(key): bytes of one group element or modulus, payload_size(key): bytes of data per block
+# public(key) and private(key): the part of the key workers get for encrypt_batch and decrypt_batch
+# generate_key(args): key dict of ints for keygen, from the parsed command line
+BlockCipher = namedtuple("BlockCipher", ["name", "magic", "elements", "width", "payload_size", "public", "private",
+                                         "encrypt_batch", "decrypt_batch", "generate_key"])
+
+# Key of the current worker process, set by _init_worker
+_key = None
+
+
+def read_chunks(stream, size):
+    # Consecutive chunks of size bytes from a binary stream, the last one possibly shorter
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def ordered_parallel_map(function, iterable, workers=None, max_inflight=None, initializer=None, initargs=()):
+    # Like executor.map, but without consuming the whole input up front
+    workers = workers or os.cpu_count() or 1
+    max_inflight = max_inflight or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def open_input(path):
+    return sys.stdin.buffer if path in (None, "-") else open(path, "rb")
+
+def open_output(path):
+    return sys.stdout.buffer if path in (None, "-") else open(path, "wb")
+
+def _init_worker(key):
+    global _key
+    _key = key
+
+def worker_key():
+    # Key given to this worker process by the pool initializer
+    return _key
+
+def encrypt_iter(cipher, stream, key, workers=None, batch_blocks=64):
+    # Generator of ciphertext bytes for a binary input stream: header first, then records in input order
+    yield cipher.magic + struct.pack(">H", cipher.width(key))
+    batches = batched(read_chunks(stream, cipher.payload_size(key)), batch_blocks)
+    yield from ordered_parallel_map(cipher.encrypt_batch, batches, workers,
+                                    initializer=_init_worker, initargs=(cipher.public(key),))
+
+def read_header(cipher, stream, key):
+    # Checks the header of a ciphertext stream and returns the width of its elements
+    header = stream.read(len(cipher.magic) + 2)
+    if header[:len(cipher.magic)] != cipher.magic:
+        raise ValueError(f"Not an {cipher.name} stream ciphertext")
+    width = struct.unpack(">H", header[len(cipher.magic):])[0]
+    if width != cipher.width(key):
+        raise ValueError("Ciphertext was made for a different key")
+    return width
+
+def decrypt_iter(cipher, stream, key, workers=None, batch_blocks=64):
+    # Generator of plaintext bytes for a ciphertext stream written by encrypt_iter
+    width = read_header(cipher, stream, key)
+    batches = batched(read_chunks(stream, cipher.elements * width), batch_blocks)
+    yield from ordered_parallel_map(cipher.decrypt_batch, batches, workers,
+                                    initializer=_init_worker, initargs=(cipher.private(key),))
+
+def _tagged(function, item):
+    # Runs function on the batch of an (index, batch) work item, keeping the index with the result
+    index, batch = item
+    return index, function(batch)
+
+def _map_messages(function, batches_per_message, pool_key, workers=None):
+    # Blocks of every message go through one pool, then are joined back per message in input order
+    items = ((index, batch) for index, batches in enumerate(batches_per_message) for batch in batches)
+    parts = [[] for _ in batches_per_message]
+    for index, data in ordered_parallel_map(partial(_tagged, function), items, workers,
+                                            initializer=_init_worker, initargs=(pool_key,)):
+        parts[index].append(data)
+    return parts
+
+def encrypt_messages(cipher, messages, key, workers=None, batch_blocks=64):
+    # Batch API: one ciphertext (bytes) per message
+    header = cipher.magic + struct.pack(">H", cipher.width(key))
+    batches = [list(batched(read_chunks(io.BytesIO(message), cipher.payload_size(key)), batch_blocks))
+               for message in messages]
+    parts = _map_messages(cipher.encrypt_batch, batches, cipher.public(key), workers)
+    return [header + b"".join(records) for records in parts]
+
+def decrypt_messages(cipher, ciphertexts, key, workers=None, batch_blocks=64):
+    batches = []
+    for ciphertext in ciphertexts:
+        stream = io.BytesIO(ciphertext)
+        width = read_header(cipher, stream, key)
+        batches.append(list(batched(read_chunks(stream, cipher.elements * width), batch_blocks)))
+    return [b"".join(blocks) for blocks in _map_messages(cipher.decrypt_batch, batches, cipher.private(key), workers)]
+
+def load_key(path):
+    with open(path) as f:
+        return {name: int(value) for name, value in json.load(f).items()}
+
+def save_key(path, key):
+    with open(path, "w") as f:
+        json.dump({name: str(value) for name, value in key.items()}, f)
+
+def build_parser(prog=None, description=None, epilog=None):
+    # Command line shared by the stream ciphers. Scripts add their own keygen options
+    parser = argparse.ArgumentParser(prog=prog, description=description, epilog=epilog,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('mode', choices=['keygen', 'encrypt', 'decrypt'], help='What to do')
+    parser.add_argument('key', type=str, help='Key file (JSON). Written by keygen, read by encrypt and decrypt')
+    parser.add_argument('-i', '--input', type=str, default=None, help='Input file. Defaults to stdin')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Output file. Defaults to stdout')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes. Defaults to CPU count')
+    parser.add_argument('--batch', type=int, default=64, help='Blocks per work item. Defaults to 64')
+    return parser
+
+def run(cipher, args):
+    if args.mode == 'keygen':
+        save_key(args.key, cipher.generate_key(args))
+        return
+
+    key = load_key(args.key)
+    pipeline = encrypt_iter if args.mode == 'encrypt' else decrypt_iter
+    in_stream = open_input(args.input)
+    out_stream = open_output(args.output)
+    try:
+        for data in pipeline(cipher, in_stream, key, args.workers, args.batch):
+            out_stream.write(data)
+    finally:
+        if args.input not in (None, '-'):
+            in_stream.close()
+        if args.output not in (None, '-'):
+            out_stream.close()
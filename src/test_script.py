@@ -2,22 +2,25 @@
 This is a temporary script that shall be deleted later
 It serves to check if all packages were installed and to generate the requirements file
 """
+import argparse
+import json
+import textwrap
+
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
-from qiskit import Aer, transpile
+from qiskit import Aer
 
-from qiskit.tools.visualization import plot_histogram
+from circuit_cache import cached_transpile
+import backend_selection
+from backend_selection import prepare
+from instrumentation import span
+from statevector_sampling import exact_probabilities, nonzero_probabilities, sample_counts, bitstring_counts
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-def main():
+def build_circuit(i, j):
     # Simple bell state creation
     qc = QuantumCircuit(QuantumRegister(1, "q0"), QuantumRegister(1, "q1"), ClassicalRegister(2))
 
-    # See which state will be created
-    i = np.random.randint(0, 2) # Qubit 1
-    j = np.random.randint(0, 2) # Qubit 0
-
     # Circuit and measure
     if i == 1:
         qc.x(1)
@@ -27,20 +30,83 @@ def main():
     qc.h(1)
     qc.cx(1, 0)
     qc.measure([0, 1], [0, 1])
+    return qc
 
-    # Plot in mpl
-    qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
-    plt.show()
+def main(use_cache=True, headless=False, statevector=False, shots=1024, seed=None):
+    # One generator, seeded or not, picks the state and draws the statevector mode's shots
+    rng = np.random.default_rng(seed)
+
+    # See which state will be created
+    i = int(rng.integers(0, 2)) # Qubit 1
+    j = int(rng.integers(0, 2)) # Qubit 0
 
-    # Compile and run locally
+    # Compile locally, or load the transpiled circuit from the cache
     simulator = Aer.get_backend('aer_simulator')
-    transpiled = transpile(qc, simulator)
+    transpiled, qc = cached_transpile("test_script", {"i": i, "j": j}, lambda: build_circuit(i, j), simulator, use_cache)
+
+    output = {"i": i, "j": j, "shots": shots}
+    if statevector:
+        # Exact probabilities from one run without measurements, then a single multinomial draw for all shots
+        probabilities = exact_probabilities(transpiled, simulator)
+        output["probabilities"] = {format(y, "02b"): p for y, p in nonzero_probabilities(probabilities).items()}
+        data = bitstring_counts(sample_counts(probabilities, shots, rng), 2)
+    else:
+        # Clifford circuit: runs on the stabilizer method
+        circuit, decision = prepare(transpiled)
+        with span("aer_run", method=decision["method"]) as run_span:
+            result = simulator.run(circuit, shots=shots, seed_simulator=seed, **decision["options"]).result()
+            run_span.aer_result(result)
+        data = result.get_counts()
+    output["counts"] = dict(data)
+
+    # Headless: no plots, one JSON object on stdout
+    if headless:
+        print(json.dumps(output))
+        return
+
+    import matplotlib.pyplot as plt
+    from qiskit.tools.visualization import plot_histogram
+
+    # Plot in mpl
+    if qc is not None:
+        qc.draw(output='mpl', initial_state=True, reverse_bits=True)  # Reverse for visualization, highest is MSQ
+        plt.show()
 
-    result = simulator.run(transpiled).result()
-    data = result.get_counts()
     print(data)
     plot_histogram(data, title=f"Measurements for Bell State $|\psi-{i}{j}>$")
     plt.show()
 
+def build_parser(prog=None):
+    # Script instruction
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=textwrap.dedent(
+            """
+            Installation check: prepares a random Bell state, simulates it on Aer and plots the measurements
+            """),
+        epilog=textwrap.dedent(
+            """
+            Example usages:
+            python src/test_script.py
+            python src/test_script.py --statevector -s 1000000 --seed 3
+            python src/test_script.py --headless > result.json
+            """),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-s', '--shots', type=int, default=1024, help='Number of shots. Defaults to 1024')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the Bell state choice and the sampling')
+    parser.add_argument('--statevector', action='store_true',
+                        help='Simulate once without measurements and sample the exact distribution')
+    parser.add_argument('--no-cache', action='store_true', help='Always build and transpile, skipping the on-disk circuit cache')
+    parser.add_argument('--headless', action='store_true', help='Batch mode: no drawing or plots, results printed as JSON')
+    backend_selection.add_arguments(parser)
+    return parser
+
+def run(args):
+    backend_selection.configure_from(args, verbose=not args.headless)
+    try:
+        main(not args.no_cache, args.headless, args.statevector, args.shots, args.seed)
+    except MemoryError as error:
+        print(json.dumps({"error": str(error)}) if args.headless else error)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run(build_parser().parse_args())
\ No newline at end of file